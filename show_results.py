@@ -8,11 +8,11 @@ import json
 import pandas as pd
 import seaborn as sns
 
-from scipy.io import loadmat
 from matplotlib import pyplot as plt
 import numpy as np
 
 from src.model.blind import MiSiCNet
+from src.data.base import load_estimate
 
 accepted_supervised_models = ["FCLS", "UnDIP"]
 accepted_blind_models = ["MiSiCNet", "MSNet"]
@@ -241,7 +241,9 @@ def show_results(metric: str):
 
     for run in runlist:
         # print(run)
-        res = loadmat(f'{os.getcwd()}/logs/{run}/artifacts/Estimate/estimates.mat')
+        estimates = f'{os.getcwd()}/logs/{run}/artifacts/Estimate/estimates'
+        ext = '.h5' if os.path.exists(f'{estimates}.h5') else '.mat'
+        res = load_estimate(f'{estimates}{ext}')
         num_of_ems = res['E'].shape[1]
         A = res['A']
 
@@ -6,7 +6,7 @@ from mlxp.launcher import _instance_from_config
 import logging
 import numpy as np
 
-from src.data.utils import SVD_projection
+from src.data.utils import preprocess_sweep
 from src.utils.aligners import AbundancesAligner
 from src.utils.metrics import SRE, SADDegrees, aRMSE, eRMSE, compute_metric
 from src.data.base import Estimate
@@ -14,33 +14,20 @@ from src.data.base import Estimate
 log = logging.getLogger(__name__)
 
 
-def main(ctx: mlxp.Context) -> None:
+def unmix(ctx, hsi, Y, p, H, W, suffix="", tags=None):
+    """
+    Estimate and evaluate the endmembers and abundances of one (noisy) input HSI
 
+    `suffix` is appended to the estimates artifact name and `tags` are
+    logged along with the metrics (e.g. SNR and seed of a sweep).
+    """
     cfg = ctx.config
     logger = ctx.logger
-    log.info("Blind Unmixing - [START]")
+    tags = {} if tags is None else tags
+
+    def log_metrics(metrics, log_name):
+        logger.log_metrics({**tags, **metrics}, log_name=log_name)
 
-    # Get noise
-    noise = _instance_from_config(cfg.noise)
-    # Get HSI
-    hsi = _instance_from_config(cfg.data)
-    # Print HSI information
-    log.info(hsi)
-    # Get data
-    Y, p, _ = hsi.get_data()
-    # Get image dimensions
-    H, W = hsi.get_img_shape()
-    # Normalize HSI
-    # Y = (Y - Y.min()) / (Y.max() - Y.min())
-    # Apply noise
-    Y = noise.apply(Y)
-    # L2 normalization
-    if cfg.l2_normalization:
-        normY = np.linalg.norm(Y, axis=0, ord=2, keepdims=True)
-        Y = Y / normY
-    # Apply SVD projection
-    if cfg.projection:
-        Y = SVD_projection(Y, p)
     # Build model
     model = _instance_from_config(cfg.model)
     # Solve unmixing
@@ -51,7 +38,10 @@ def main(ctx: mlxp.Context) -> None:
         W=W,
     )
 
-    logger.log_artifact(Estimate(E_hat, A_hat, H, W), "estimates")
+    logger.log_artifact(
+        Estimate(E_hat, A_hat, H, W, fmt=cfg.estimates_format),
+        f"estimates{suffix}",
+    )
 
     if hsi.has_GT():
         # Get ground truth
@@ -63,7 +53,7 @@ def main(ctx: mlxp.Context) -> None:
         # Get labels
         labels = hsi.get_labels()
         # Compute and log metrics
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 SRE(),
                 A_gt,
@@ -74,7 +64,7 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="SRE",
         )
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 aRMSE(),
                 A_gt,
@@ -85,7 +75,7 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="aRMSE",
         )
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 SADDegrees(),
                 E_gt,
@@ -96,7 +86,7 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="SAD",
         )
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 eRMSE(),
                 E_gt,
@@ -108,6 +98,46 @@ def main(ctx: mlxp.Context) -> None:
             log_name="eRMSE",
         )
 
+
+def main(ctx: mlxp.Context) -> None:
+
+    cfg = ctx.config
+    log.info("Blind Unmixing - [START]")
+
+    # Get noise
+    noise = _instance_from_config(cfg.noise)
+    # Get HSI
+    hsi = _instance_from_config(cfg.data)
+    # Print HSI information
+    log.info(hsi)
+    # Get data
+    Y, p, _ = hsi.get_data()
+    # Get image dimensions
+    H, W = hsi.get_img_shape()
+    # Normalize HSI
+    # Y = (Y - Y.min()) / (Y.max() - Y.min())
+    # Apply noise, L2 normalization and SVD projection
+    # NOTE A sweep over (SNR, seed) pairs runs on a single load of the data
+    inputs = preprocess_sweep(
+        hsi,
+        noise,
+        p,
+        SNRs=cfg.sweep_SNRs,
+        seeds=cfg.sweep_seeds,
+        l2_normalization=cfg.l2_normalization,
+        projection=cfg.projection,
+        projection_method=cfg.projection_method,
+        cache=cfg.inputs_cache,
+        seed=cfg.seed,
+    )
+    for SNR, seed, Y, _ in inputs:
+        if cfg.sweep_SNRs is None:
+            unmix(ctx, hsi, Y, p, H, W)
+        else:
+            log.info(f"Sweep => SNR: {SNR}, seed: {seed}")
+            tags = {"SNR": SNR, "seed": seed}
+            unmix(ctx, hsi, Y, p, H, W, suffix=f"-SNR{SNR}-seed{seed}", tags=tags)
+
     hsi.plot_endmembers()
     hsi.plot_abundances()
 
@@ -3,30 +3,83 @@ HSI data base class
 """
 import logging
 import os
+import warnings
 from dataclasses import dataclass
 
 # from hydra.utils import to_absolute_path
 import scipy.io as sio
+import scipy.sparse as sp
 import numpy as np
 import matplotlib.pyplot as plt
 from mlxp.data_structures.artifacts import Artifact
 
 from src import EPS
+from .matfile import MatFile
+from .cache import DatasetCache
+from .envi import EnviFile
+from .pyramid import PyramidFile, PYRAMID_EXT
+from .utils import iter_tiles
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+try:
+    import h5py
+except Exception:
+    warnings.warn("h5py was not imported. HDF5 estimates will not be available")
+
 INTEGER_VALUES = ("H", "W", "M", "L", "p", "N")
+# Spatial size of the chunks of the abundances in `.h5` estimates
+ESTIMATE_CHUNK = 256
+# Arrays read from the data file on first access (with their null dimensions)
+LAZY_VALUES = {
+    "Y": ("L", "N"),
+    "E": ("L", "p"),
+    "A": ("p", "N"),
+    "D": ("L", "M"),
+}
+
+
+def _lazy_array(key):
+    """
+    Array attribute materialized from the data file on first access
+    """
+
+    def getter(self):
+        if key not in self._arrays:
+            self._arrays[key] = self._load(key)
+        return self._arrays[key]
+
+    def setter(self, value):
+        self._arrays[key] = value
+
+    return property(getter, setter)
 
 
 class HSI:
+    # Data file extension
+    EXT = ".mat"
+
+    Y = _lazy_array("Y")
+    E = _lazy_array("E")
+    A = _lazy_array("A")
+    D = _lazy_array("D")
+
     def __init__(
         self,
         dataset: str,
         data_dir: str = "./data",
         figs_dir: str = "./figs",
+        cache: bool = False,
+        dtype: str = "float64",
+        level: int = None,
     ) -> None:
 
+        # Floating point precision of the arrays
+        self.dtype = np.dtype(dtype)
+        # Resolution level read from a pyramid file (see `src.data.pyramid`)
+        self.level = level
+
         # Populate with Null data
         # integers
         self.H = 0
@@ -35,48 +88,52 @@ class HSI:
         self.L = 0
         self.p = 0
         self.N = 0
-        # arrays
-        self.Y = np.zeros((self.L, self.N))
-        self.E = np.zeros((self.L, self.p))
-        self.A = np.zeros((self.p, self.N))
-        self.D = np.zeros((self.L, self.M))
+        # arrays (lazily read from the data file)
+        self._arrays = {}
+        self._reader = None
         self.labels = []
         self.index = []
 
         # Locate and check data file
         self.name = dataset
-        filename = f"{self.name}.mat"
+        filename = f"{self.name}{self.EXT if level is None else PYRAMID_EXT}"
         # path = to_absolute_path(os.path.join(data_dir, filename))
         path = os.path.join(data_dir, filename)
         log.debug(f"Path to be opened: {path}")
         assert os.path.isfile(path)
+        self.data_dir = data_dir
+        # Files holding the data (used to fingerprint the dataset)
+        self.sources = [path]
 
-        # Open data file
-        data = sio.loadmat(path)
-        log.debug(f"Data keys: {data.keys()}")
+        # Open data file (only variables names and shapes are read)
+        self._reader = self._open(path, cache)
+        keys = self._reader.keys()
+        log.debug(f"Data keys: {keys}")
 
         # Populate attributes based on data file values
+        # NOTE Large arrays are only read when first accessed
         for key in filter(
-            lambda k: not k.startswith("__"),
-            data.keys(),
+            lambda k: not k.startswith("__") and k not in LAZY_VALUES,
+            keys,
         ):
+            value = self._reader.load(key)
             self.__setattr__(
-                key, data[key].item() if key in INTEGER_VALUES else data[key]
+                key, int(value.item()) if key in INTEGER_VALUES else value
             )
 
-        if "N" not in data.keys():
+        if "N" not in keys:
             self.N = self.H * self.W
 
         # Check data
         assert self.N == self.H * self.W
-        assert self.Y.shape == (self.L, self.N)
+        assert self.shape("Y") == (self.L, self.N)
 
         self.has_dict = False
-        if "D" in data.keys():
+        if "D" in keys:
             self.has_dict = True
-            assert self.D.shape == (self.L, self.M)
+            assert self.shape("D") == (self.L, self.M)
 
-        if "index" in data.keys():
+        if "index" in keys:
             self.index = list(self.index.squeeze())
 
         # Create output figures folder
@@ -84,6 +141,33 @@ class HSI:
         if self.figs_dir is not None:
             os.makedirs(self.figs_dir, exist_ok=True)
 
+    def _open(self, path, cache):
+        if self.level is not None:
+            # NOTE Only the requested level is read from the pyramid
+            return PyramidFile(path, self.level)
+        if cache:
+            return DatasetCache(path).open()
+        return MatFile(path)
+
+    def _load(self, key):
+        if self._reader is not None and key in self._reader:
+            # NOTE No copy when the file already matches the requested dtype,
+            # memory-mapped arrays are exposed as plain ndarray views
+            return np.asarray(self._reader.load(key)).astype(self.dtype, copy=False)
+        # Null data
+        return np.zeros(
+            tuple(getattr(self, dim) for dim in LAZY_VALUES[key]),
+            dtype=self.dtype,
+        )
+
+    def shape(self, key):
+        """
+        Shape of a (possibly not yet loaded) array
+        """
+        if key in self._arrays or self._reader is None or key not in self._reader:
+            return getattr(self, key).shape
+        return tuple(self._reader.shape(key))
+
     def get_data(self):
         return (
             self.Y,
@@ -106,6 +190,12 @@ class HSI:
             self.W,
         )
 
+    def iter_tiles(self, tile_h, tile_w, halo=0):
+        """
+        Iterate over spatial tiles of the HSI (see `src.data.utils.iter_tiles`)
+        """
+        return iter_tiles(self.Y, self.H, self.W, tile_h, tile_w, halo)
+
     def get_labels(self):
         return self.labels
 
@@ -185,19 +275,25 @@ class HSIWithGT(HSI):
         dataset,
         data_dir,
         figs_dir,
-        p = 3 # added p argument similarly to how RealHSI is initialized
+        p = 3, # added p argument similarly to how RealHSI is initialized
+        cache=False,
+        dtype="float64",
+        level=None,
     ):
         super().__init__(
             dataset=dataset,
             data_dir=data_dir,
             figs_dir=figs_dir,
+            cache=cache,
+            dtype=dtype,
+            level=level,
         )
 
         self.p = p
 
         # Sanity check on ground truth
-        assert self.E.shape == (self.L, self.p)
-        assert self.A.shape == (self.p, self.N)
+        assert self.shape("E") == (self.L, self.p)
+        assert self.shape("A") == (self.p, self.N)
 
         try:
             assert len(self.labels) == self.p
@@ -208,6 +304,12 @@ class HSIWithGT(HSI):
             # Create numerated labels
             self.labels = [f"#{ii}" for ii in range(self.p)]
 
+        # NOTE Physical constraints are checked when the GT is first requested
+        self._GT_checked = False
+
+    def _check_GT(self):
+        # NOTE Cached datasets record the validation results
+        checks = self._reader.checks
         # Check physical constraints
         # Abundance Sum-to-One Constraint (ASC)
         # NOTE sum to one constraint not enforced because the reference plates are
@@ -219,11 +321,14 @@ class HSIWithGT(HSI):
         #     atol=1e-3,
         # )
         # Abundance Non-negative Constraint (ANC)
-        assert np.all(self.A >= -EPS)
+        assert checks["ANC"] if "ANC" in checks else np.all(self.A >= -EPS)
         # Endmembers Non-negative Constraint (ENC)
-        assert np.all(self.E >= -EPS)
+        assert checks["ENC"] if "ENC" in checks else np.all(self.E >= -EPS)
+        self._GT_checked = True
 
     def get_GT(self):
+        if not self._GT_checked:
+            self._check_GT()
         return (
             self.E,
             self.A,
@@ -240,11 +345,17 @@ class RealHSI(HSI):
         data_dir,
         figs_dir,
         p=3,
+        cache=False,
+        dtype="float64",
+        level=None,
     ):
         super().__init__(
             dataset=dataset,
             data_dir=data_dir,
             figs_dir=figs_dir,
+            cache=cache,
+            dtype=dtype,
+            level=level,
         )
         self.p = p
         # Create labels
@@ -254,17 +365,152 @@ class RealHSI(HSI):
         return False
 
 
+class ENVIHSI(RealHSI):
+    """
+    Real HSI read from an ENVI `<dataset>.hdr` header and its binary cube
+
+    The cube is memory-mapped (see `src.data.envi.EnviFile`).
+    """
+
+    EXT = ".hdr"
+
+    def _open(self, path, cache):
+        assert self.level is None, "Pyramid levels are not available for ENVI cubes"
+        if cache:
+            log.warning("ENVI cubes are already memory-mapped, cache ignored")
+        reader = EnviFile(path)
+        self.sources.append(reader.image_path)
+        return reader
+
+
+# Estimates file extension for each storage format
+ESTIMATE_FORMATS = {"mat": ".mat", "h5": ".h5"}
+
+
 @dataclass
 class Estimate(Artifact):
+    """
+    Estimated endmembers and abundances
+
+    The `mat` format writes a single `.mat` file.
+    The `h5` format writes the abundances (p, H, W) in compressed HDF5 chunks
+    of spatial windows of each map, so that a single map or window can be
+    read back without loading the others (see `load_estimate`).
+    """
 
     ext = ".mat"
 
-    def __init__(self, Ehat, Ahat, H, W):
-        data = {"E": Ehat, "A": Ahat.reshape(-1, H, W)}
-        super().__init__(obj=data, ext=self.ext)
+    def __init__(self, Ehat, Ahat, H, W, fmt="mat"):
+        if sp.issparse(Ahat):
+            # NOTE Sparse abundances are kept flattened (M x N) in CSR format
+            data = {"E": Ehat, "A": sp.csr_matrix(Ahat), "H": H, "W": W}
+        else:
+            data = {"E": Ehat, "A": Ahat.reshape(-1, H, W)}
+        super().__init__(obj=data, ext=ESTIMATE_FORMATS[fmt])
 
     def _save(self, fname="estimates"):
-        sio.savemat(f"{fname}{self.ext}", self.obj)
+        if self.ext == ".mat":
+            sio.savemat(f"{fname}{self.ext}", self.obj)
+            return
+
+        A = self.obj["A"]
+        with h5py.File(f"{fname}{self.ext}", "w") as f:
+            f.create_dataset("E", data=self.obj["E"])
+            if sp.issparse(A):
+                group = f.create_group("A")
+                for key in ("data", "indices", "indptr"):
+                    group.create_dataset(
+                        key,
+                        data=getattr(A, key),
+                        compression="gzip",
+                        shuffle=True,
+                    )
+                group.attrs["H"] = self.obj["H"]
+                group.attrs["W"] = self.obj["W"]
+                return
+
+            _, H, W = A.shape
+            f.create_dataset(
+                "A",
+                data=A,
+                chunks=(1, min(H, ESTIMATE_CHUNK), min(W, ESTIMATE_CHUNK)),
+                compression="gzip",
+                shuffle=True,
+            )
+
+
+def load_estimate(path, atoms=None, window=None):
+    """
+    Read estimates saved by `Estimate`
+
+    atoms: abundance maps to read (index, slice or list, default: all)
+    window: spatial window (row, col, height, width) of the maps (default: all)
+
+    Only the requested chunks are decoded for `.h5` estimates, sparse
+    abundances only read the non-zeros of the requested atoms.
+    Returns a dict with `E` (L x p) and `A` (p_atoms x height x width).
+    """
+    atoms = slice(None) if atoms is None else atoms
+    if window is None:
+        rows, cols = slice(None), slice(None)
+    else:
+        row, col, height, width = window
+        rows, cols = slice(row, row + height), slice(col, col + width)
+
+    if os.path.splitext(path)[1] == ".mat":
+        data = sio.loadmat(path)
+        A = data["A"]
+        if sp.issparse(A):
+            H, W = int(data["H"].item()), int(data["W"].item())
+            A = sp.csr_matrix(A)
+            atoms = np.arange(A.shape[0])[atoms]
+            A = _sparse_maps(A[np.atleast_1d(atoms)], atoms, H, W, rows, cols)
+            return {"E": data["E"], "A": A}
+        return {"E": data["E"], "A": A[atoms, rows, cols]}
+
+    with h5py.File(path, "r") as f:
+        if isinstance(f["A"], h5py.Group):
+            group = f["A"]
+            H, W = int(group.attrs["H"]), int(group.attrs["W"])
+            indptr = group["indptr"][()]
+            atoms = np.arange(len(indptr) - 1)[atoms]
+            # NOTE Only the non-zeros of the requested atoms are read
+            data, indices, sub_indptr = [], [], [0]
+            for atom in np.atleast_1d(atoms):
+                start, stop = indptr[atom], indptr[atom + 1]
+                data.append(group["data"][start:stop])
+                indices.append(group["indices"][start:stop])
+                sub_indptr.append(sub_indptr[-1] + stop - start)
+            A = sp.csr_matrix(
+                (np.concatenate(data), np.concatenate(indices), sub_indptr),
+                shape=(len(sub_indptr) - 1, H * W),
+            )
+            return {"E": f["E"][()], "A": _sparse_maps(A, atoms, H, W, rows, cols)}
+
+        if isinstance(atoms, (list, np.ndarray)):
+            # NOTE h5py fancy indexing requires unique increasing indices
+            unique, inverse = np.unique(atoms, return_inverse=True)
+            A = f["A"][unique, rows, cols][inverse]
+        else:
+            A = f["A"][atoms, rows, cols]
+        return {"E": f["E"][()], "A": A}
+
+
+def _sparse_maps(A, atoms, H, W, rows, cols):
+    """
+    Dense abundance maps (windows) of the selected sparse rows A
+    """
+    maps = A.toarray().reshape(-1, H, W)[:, rows, cols]
+    return maps if np.ndim(atoms) else maps[0]
+
+
+def export_mat(path, dst=None):
+    """
+    Export `.h5` estimates to a `.mat` file next to them (on demand)
+    """
+    dst = f"{os.path.splitext(path)[0]}.mat" if dst is None else dst
+    sio.savemat(dst, load_estimate(path))
+    return dst
 
 
 if __name__ == "__main__":
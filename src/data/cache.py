@@ -0,0 +1,242 @@
+"""
+Binary cache of `.mat` datasets
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from src import EPS
+from .matfile import MatFile
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+CACHE_VERSION = 1
+META_FILENAME = "meta.json"
+
+
+def file_hash(path, chunk_size=2**24):
+    """
+    SHA-256 content hash of a file, read by chunks
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class NpyBundle:
+    """
+    Reader on a cached dataset, exposing the same interface as `MatFile`
+
+    Every variable is stored in its own `.npy` file and memory-mapped on load.
+    """
+
+    def __init__(self, cache_dir, meta):
+        self.path = cache_dir
+        self.meta = meta
+        self._shapes = {k: tuple(v["shape"]) for k, v in meta["variables"].items()}
+        # Ground truth validation recorded when building the cache
+        self.checks = meta["checks"]
+
+    def keys(self):
+        return self._shapes.keys()
+
+    def __contains__(self, key):
+        return key in self._shapes
+
+    def shape(self, key):
+        return self._shapes[key]
+
+    def load(self, key):
+        log.debug(f"Loading {key} from {self.path}")
+        fname = os.path.join(self.path, f"{key}.npy")
+        if self.meta["variables"][key]["dtype"] == "object":
+            # NOTE cell arrays (e.g. labels) cannot be memory-mapped
+            return np.load(fname, allow_pickle=True)
+        return np.load(fname, mmap_mode="r")
+
+    def close(self):
+        pass
+
+
+class DatasetCache:
+    """
+    Binary copy of a `.mat` dataset stored next to it
+
+    The cache directory `<dataset>.cache/` holds one `.npy` file per variable
+    and a `meta.json` file recording the source file size, mtime and content
+    hash, along with the ground truth validation results.
+    The cache is rebuilt whenever the source file content changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cache_dir = f"{os.path.splitext(path)[0]}.cache"
+        self.meta_path = os.path.join(self.cache_dir, META_FILENAME)
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta, cache_dir=None):
+        cache_dir = self.cache_dir if cache_dir is None else cache_dir
+        with open(os.path.join(cache_dir, META_FILENAME), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def is_valid(self, meta=None):
+        meta = self._read_meta() if meta is None else meta
+        if meta is None or meta.get("version") != CACHE_VERSION:
+            return False
+
+        stat = os.stat(self.path)
+        source = meta["source"]
+        if stat.st_size != source["size"]:
+            return False
+        if stat.st_mtime_ns == source["mtime_ns"]:
+            return True
+
+        # Same size but touched file => compare contents
+        log.debug(f"{self.path} modification time changed, checking content hash")
+        if file_hash(self.path) != source["sha256"]:
+            return False
+        source["mtime_ns"] = stat.st_mtime_ns
+        self._write_meta(meta)
+        return True
+
+    def build(self):
+        log.info(f"Building dataset cache for {self.path} in {self.cache_dir}")
+        stat = os.stat(self.path)
+        tmp_dir = f"{self.cache_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        reader = MatFile(self.path)
+        variables = {}
+        checks = {}
+        for key in filter(lambda k: not k.startswith("__"), reader.keys()):
+            value = reader.load(key)
+            np.save(
+                os.path.join(tmp_dir, f"{key}.npy"),
+                value,
+                allow_pickle=value.dtype == object,
+            )
+            variables[key] = {
+                "shape": list(value.shape),
+                "dtype": str(value.dtype),
+            }
+            # Physical constraints of the ground truth (see `HSIWithGT`)
+            if key == "A":
+                checks["ANC"] = bool(np.all(value >= -EPS))
+            elif key == "E":
+                checks["ENC"] = bool(np.all(value >= -EPS))
+        reader.close()
+
+        meta = {
+            "version": CACHE_VERSION,
+            "source": {
+                "path": os.path.abspath(self.path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_hash(self.path),
+            },
+            "variables": variables,
+            "checks": checks,
+        }
+        self._write_meta(meta, tmp_dir)
+
+        # Swap the new cache in place of the stale one
+        # NOTE Parallel jobs may rebuild the same cache: swaps are serialized
+        # by a lock file and the first valid cache swapped in is kept
+        with open(f"{self.cache_dir}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current = self._read_meta()
+            if self.is_valid(current):
+                log.debug(f"Dataset cache {self.cache_dir} built by another job")
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return current
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.rename(tmp_dir, self.cache_dir)
+        return meta
+
+    def open(self):
+        meta = self._read_meta()
+        if not self.is_valid(meta):
+            meta = self.build()
+        else:
+            log.debug(f"Using dataset cache {self.cache_dir}")
+        return NpyBundle(self.cache_dir, meta)
+
+
+class NoisyInputCache:
+    """
+    Content-addressed store of preprocessed (noisy, normalized, projected) inputs
+
+    Inputs are stored as `.npy` files under `<data_dir>/.inputs/`, named after
+    the hash of the dataset content, noise configuration, seed and
+    preprocessing options, and memory-mapped on reuse so that every model
+    runs on bit-identical inputs.
+    """
+
+    def __init__(self, data_dir):
+        self.cache_dir = os.path.join(data_dir, ".inputs")
+        self.hashes_path = os.path.join(self.cache_dir, "hashes.json")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def source_hash(self, path):
+        """
+        Content hash of a source file, recomputed only when it changed
+        """
+        try:
+            with open(self.hashes_path, "r") as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            hashes = {}
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = hashes.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_hash(path),
+            }
+            hashes[path] = entry
+            tmp_path = f"{self.hashes_path}.tmp-{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                json.dump(hashes, f, indent=2)
+            os.replace(tmp_path, self.hashes_path)
+        return entry["sha256"]
+
+    def key(self, sources, **config):
+        description = {
+            "version": CACHE_VERSION,
+            "sources": [self.source_hash(path) for path in sources],
+            **config,
+        }
+        content = json.dumps(description, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def load(self, key):
+        fname = os.path.join(self.cache_dir, f"{key}.npy")
+        if not os.path.isfile(fname):
+            return None
+        log.debug(f"Using cached inputs {fname}")
+        return np.load(fname, mmap_mode="r")
+
+    def save(self, key, Y):
+        fname = os.path.join(self.cache_dir, f"{key}.npy")
+        tmp_fname = f"{fname}.tmp-{os.getpid()}.npy"
+        np.save(tmp_fname, Y)
+        os.replace(tmp_fname, fname)
+        log.info(f"Inputs cached in {fname}")
+        return np.load(fname, mmap_mode="r")
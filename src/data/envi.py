@@ -0,0 +1,99 @@
+"""
+ENVI data cubes lazy reading utilities
+"""
+import logging
+import warnings
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+try:
+    from spectral import BIL
+    from spectral.io import envi
+except Exception:
+    warnings.warn("spectral was not imported. ENVI cubes will not be readable")
+
+
+class EnviFile:
+    """
+    Lazy reader on an ENVI `.hdr/.img` cube, exposing the same interface as `MatFile`
+
+    Opening the file only parses the header.
+    The cube is memory-mapped on `load` and exposed as `Y` (`L` x `N`,
+    pixels in row-major order):
+        - BSQ cubes are returned as a plain view,
+        - BIP cubes are returned as a transposed (Fortran ordered) view,
+        - BIL cubes cannot be flattened without reordering the samples
+        and are streamed line by line into a preallocated array.
+
+    A copy is also made when the header sets a reflectance scale factor.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # No validation results are recorded in raw data files
+        self.checks = {}
+
+        self._img = envi.open(path)
+        self.image_path = self._img.filename
+        H, W, L = self._img.shape
+        self._values = {"H": H, "W": W, "L": L, "N": H * W}
+        if self._img.bands.centers is not None:
+            self._values["wavelengths"] = np.array(self._img.bands.centers)
+
+        self._shapes = {key: (1, 1) for key in ("H", "W", "L", "N")}
+        self._shapes["Y"] = (L, H * W)
+        if "wavelengths" in self._values:
+            self._shapes["wavelengths"] = (1, L)
+
+        log.debug(f"ENVI cube found in {path}: {self._img.shape} (H, W, L)")
+
+    def keys(self):
+        return self._shapes.keys()
+
+    def __contains__(self, key):
+        return key in self._shapes
+
+    def shape(self, key):
+        return self._shapes[key]
+
+    def load(self, key):
+        if key != "Y":
+            return np.atleast_2d(self._values[key])
+
+        log.debug(f"Memory-mapping {self.path}")
+        L, N = self._shapes["Y"]
+        scale = getattr(self._img, "scale_factor", 1.0)
+        if self._img.interleave == BIL:
+            return self._load_bil(L, N, scale)
+
+        # NOTE (transposed) view on the source memmap
+        Y = self._img.open_memmap(interleave="bsq").reshape(L, N)
+        if scale != 1.0:
+            Y = Y / scale
+        return Y
+
+    def _load_bil(self, L, N, scale):
+        """
+        Copy a BIL cube into `Y`, one image line (`L` x `W`) at a time
+
+        Only the output array and a single line are held in memory, the
+        scale factor being applied on the fly.
+        """
+        log.debug("BIL interleave => ENVI cube streamed in memory")
+        # (H, L, W) memmap in file order
+        source = self._img.open_memmap(interleave="bil")
+        H, _, W = source.shape
+        dtype = source.dtype if scale == 1.0 else np.result_type(source.dtype, 1.0)
+        Y = np.empty((L, N), dtype=dtype)
+        for h in range(H):
+            line = Y[:, h * W : (h + 1) * W]
+            np.copyto(line, source[h], casting="unsafe")
+            if scale != 1.0:
+                line /= scale
+        return Y
+
+    def close(self):
+        self._img = None
@@ -0,0 +1,184 @@
+"""
+MATLAB data files lazy reading utilities
+"""
+import datetime
+import logging
+import warnings
+
+import numpy as np
+import scipy.io as sio
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+try:
+    import h5py
+except Exception:
+    warnings.warn("h5py was not imported. MATLAB v7.3 files will not be readable")
+
+MAT73_HEADER = b"MATLAB 7.3 MAT-file"
+# HDF5 user block holding the MATLAB header
+MAT73_USERBLOCK = 512
+# MATLAB classes of the numeric types written by `savemat73`
+MATLAB_CLASSES = {
+    "float64": "double",
+    "float32": "single",
+    "int8": "int8",
+    "int16": "int16",
+    "int32": "int32",
+    "int64": "int64",
+    "uint8": "uint8",
+    "uint16": "uint16",
+    "uint32": "uint32",
+    "uint64": "uint64",
+    "bool": "logical",
+}
+
+
+def is_mat73(path):
+    """
+    Check whether a `.mat` file uses the HDF5 based v7.3 format
+    """
+    with open(path, "rb") as f:
+        header = f.read(len(MAT73_HEADER))
+    return header == MAT73_HEADER
+
+
+class MatFile:
+    """
+    Lazy reader on a `.mat` file
+
+    Opening the file only reads the variables names and shapes.
+    Each variable is materialized on its first `load`.
+    MATLAB v7.3 (HDF5) variables stored contiguously are memory-mapped
+    instead of being read in memory.
+
+    Shapes follow the MATLAB convention (e.g. `Y` is `L` x `N`).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hdf5 = is_mat73(path)
+        # No validation results are recorded in raw data files
+        self.checks = {}
+
+        if self.hdf5:
+            self._file = h5py.File(path, "r")
+            # NOTE MATLAB is column-major, HDF5 shapes are reversed
+            self._shapes = {
+                key: tuple(reversed(ds.shape))
+                for key, ds in self._file.items()
+                if isinstance(ds, h5py.Dataset) and not key.startswith("#")
+            }
+        else:
+            self._file = None
+            self._shapes = {name: shape for name, shape, _ in sio.whosmat(path)}
+
+        log.debug(f"Variables found in {path}: {self._shapes}")
+
+    def keys(self):
+        return self._shapes.keys()
+
+    def __contains__(self, key):
+        return key in self._shapes
+
+    def shape(self, key):
+        return self._shapes[key]
+
+    def load(self, key):
+        log.debug(f"Loading {key} from {self.path}")
+        if self.hdf5:
+            return self._load_hdf5(self._file[key])
+        return sio.loadmat(self.path, variable_names=[key])[key]
+
+    def _load_hdf5(self, ds):
+        matlab_class = ds.attrs.get("MATLAB_class", b"double")
+        if isinstance(matlab_class, bytes):
+            matlab_class = matlab_class.decode()
+
+        if ds.attrs.get("MATLAB_empty", 0):
+            return np.zeros((0, 0))
+
+        if matlab_class == "char":
+            chars = np.atleast_2d(ds[()]).T
+            return np.array(["".join(map(chr, row)) for row in chars])
+
+        if matlab_class == "cell":
+            refs = ds[()]
+            cells = np.empty(refs.shape, dtype=object)
+            for idx, ref in np.ndenumerate(refs):
+                cells[idx] = self._load_hdf5(self._file[ref])
+            return cells.T
+
+        offset = ds.id.get_offset()
+        if ds.chunks is None and ds.compression is None and offset is not None:
+            arr = np.memmap(
+                self.path,
+                dtype=ds.dtype,
+                mode="r",
+                offset=offset,
+                shape=ds.shape,
+            )
+        else:
+            arr = ds[()]
+
+        if matlab_class == "logical":
+            arr = arr.astype(bool)
+
+        return arr.T
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _write_mat73_header(path):
+    created = datetime.datetime.now().strftime("%a %b %d %H:%M:%S %Y")
+    text = f"{MAT73_HEADER.decode()}, Platform: GLNXA64, Created on: {created} HDF5 schema 1.00 ."
+    header = text.encode().ljust(116, b" ")
+    # Subsystem data offset, version 0x0200 and endian indicator
+    header += b"\x00" * 8 + b"\x00\x02" + b"IM"
+    with open(path, "r+b") as f:
+        f.write(header)
+
+
+def savemat73(path, data, compress=False, block_size=2**16):
+    """
+    Write numeric variables to a MATLAB v7.3 (HDF5) `.mat` file
+
+    Arrays are written by blocks of `block_size` slices along their last axis.
+    Uncompressed variables are stored contiguously so that `MatFile` can
+    memory-map them. Compressed variables are stored in gzip chunks.
+    """
+    with h5py.File(path, "w", userblock_size=MAT73_USERBLOCK) as f:
+        for key, value in data.items():
+            value = np.asarray(value)
+            if value.dtype.name not in MATLAB_CLASSES:
+                raise ValueError(f"Unsupported dtype {value.dtype} for {key}")
+            # MATLAB stores at least 2D column-major arrays
+            value = np.atleast_2d(value)
+            # NOTE HDF5 shapes are reversed
+            shape = tuple(reversed(value.shape))
+            cols = shape[0]
+            dtype = np.uint8 if value.dtype == bool else value.dtype
+
+            options = {}
+            if compress and value.size > 1:
+                # NOTE ~1MB chunks of full slices along the last axis
+                slice_size = value.size // cols
+                chunk_cols = max(1, 2**20 // (slice_size * value.itemsize))
+                options = {
+                    "chunks": (min(cols, chunk_cols),) + shape[1:],
+                    "compression": "gzip",
+                    "shuffle": True,
+                }
+            ds = f.create_dataset(key, shape=shape, dtype=dtype, **options)
+            for start in range(0, cols, block_size):
+                stop = min(start + block_size, cols)
+                ds[start:stop] = value[..., start:stop].T
+            ds.attrs["MATLAB_class"] = np.bytes_(MATLAB_CLASSES[value.dtype.name])
+            if value.dtype == bool:
+                ds.attrs["MATLAB_int_decode"] = np.int32(1)
+
+    _write_mat73_header(path)
@@ -10,43 +10,83 @@ log.setLevel(logging.DEBUG)
 
 
 class AdditiveWhiteGaussianNoise:
-    def __init__(self, SNR=None):
+    def __init__(self, SNR=None, seed=None):
         self.SNR = SNR
+        # NOTE Derived from the global numpy seed when not set
+        self.seed = seed
 
-    def apply(self, Y):
+    def _generator(self, seed=None):
+        seed = self.seed if seed is None else seed
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        return np.random.default_rng(seed)
+
+    @staticmethod
+    def signal_power(Y):
+        # NOTE Accumulate the signal power in float64
+        return np.sum(Y**2, dtype=np.float64) / Y.shape[1]
+
+    @staticmethod
+    def sigmas(L, SNR, power):
         """
-        Compute sigmas for the desired SNR given a flattened input HSI Y
+        Compute per band sigmas for the desired SNR given the signal power
+        """
+        assert SNR > 0, "SNR must be strictly positive"
+        # Uniform across bands
+        sigmas = np.ones(L)
+        # Normalization
+        sigmas /= np.linalg.norm(sigmas)
+        log.debug(f"Sigmas after normalization: {sigmas[0]}")
+        # Compute sigma mean based on SNR
+        denom = 10 ** (SNR / 10)
+        sigmas_mean = np.sqrt(power / denom)
+        log.debug(f"Sigma mean based on SNR: {sigmas_mean}")
+        # Noise variance
+        sigmas *= sigmas_mean
+        log.debug(f"Final sigmas value: {sigmas[0]}")
+        return sigmas
+
+    def apply(self, Y, seed=None):
+        """
+        Add noise at the desired SNR to a flattened input HSI Y
+
+        The noise is drawn from `default_rng(seed)` (`seed` overrides the
+        noise seed), exactly as `sweep` does for the same seed.
         """
         log.debug(f"Y shape => {Y.shape}")
         assert len(Y.shape) == 2
         L, N = Y.shape
         log.info(f"Desired SNR => {self.SNR}")
 
-        #######
-        # Fit #
-        #######
         if self.SNR is None:
-            sigmas = np.zeros(L)
-        else:
-            assert self.SNR > 0, "SNR must be strictly positive"
-            # Uniform across bands
-            sigmas = np.ones(L)
-            # Normalization
-            sigmas /= np.linalg.norm(sigmas)
-            log.debug(f"Sigmas after normalization: {sigmas[0]}")
-            # Compute sigma mean based on SNR
-            num = np.sum(Y**2) / N
-            denom = 10 ** (self.SNR / 10)
-            sigmas_mean = np.sqrt(num / denom)
-            log.debug(f"Sigma mean based on SNR: {sigmas_mean}")
-            # Noise variance
-            sigmas *= sigmas_mean
-            log.debug(f"Final sigmas value: {sigmas[0]}")
-
-        #############
-        # Transform #
-        #############
-        noise = np.diag(sigmas) @ np.random.randn(L, N)
-
-        # Return additive noise
-        return Y + noise
+            return Y
+
+        sigmas = self.sigmas(L, self.SNR, self.signal_power(Y))
+        noise = self._generator(seed).standard_normal((L, N), dtype=np.float32)
+        # NOTE Per band sigmas are broadcast over the pixels
+        noise *= sigmas[:, np.newaxis].astype(np.float32)
+
+        # Return additive noise (following the input precision)
+        return (Y + noise).astype(Y.dtype, copy=False)
+
+    def sweep(self, Y, SNRs, seeds):
+        """
+        Lazily yield (SNR, seed, noisy Y) for every (SNR, seed) pair
+
+        The signal power is computed once and a single standard normal draw
+        per seed is rescaled for every SNR.
+        """
+        assert len(Y.shape) == 2
+        L, N = Y.shape
+        power = self.signal_power(Y)
+        for seed in seeds:
+            Z = None
+            for SNR in SNRs:
+                if SNR is None:
+                    yield SNR, seed, Y
+                    continue
+                if Z is None:
+                    Z = self._generator(seed).standard_normal((L, N), dtype=np.float32)
+                sigmas = self.sigmas(L, SNR, power).astype(np.float32)
+                log.info(f"Noisy HSI => SNR: {SNR}, seed: {seed}")
+                yield SNR, seed, (Y + sigmas[:, np.newaxis] * Z).astype(Y.dtype, copy=False)
@@ -0,0 +1,210 @@
+"""
+Multi-resolution pyramid of a HSI stored in a single HDF5 file
+
+Layout of a pyramid file:
+    /E, /D, /index, /labels             shared ground truth and library
+    /level_{H}/Y                        HSI (L x N) at H lines
+    /level_{H}/A                        GT abundances (p x N) at H lines
+
+Lower resolutions are obtained by averaging blocks of `f` x `f` pixels of
+the full resolution scene. Abundances are averaged over the same blocks so
+that the linear mixing model Y = E @ A holds at every level.
+
+Usage:
+$ python -m src.data.pyramid --src ./data/FWP1_1024.mat --dst ./data/FWP1.h5 \
+    --resolutions 4 16 64 256
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import warnings
+
+import numpy as np
+
+from src import EPS
+from .matfile import MatFile
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+try:
+    import h5py
+except Exception:
+    warnings.warn("h5py was not imported. HSI pyramids will not be available")
+
+PYRAMID_EXT = ".h5"
+PYRAMID_VERSION = 1
+# Arrays stored for each level of the pyramid
+LEVEL_VALUES = ("Y", "A")
+# Scalars stored for each level of the pyramid
+LEVEL_INTEGERS = ("H", "W", "N")
+# Shared variables copied from the source file
+SHARED_VALUES = ("E", "D", "index", "labels", "p", "L", "M")
+
+
+def level_name(resolution):
+    return f"level_{resolution}"
+
+
+def block_average(X, H, W, f):
+    """
+    Average the blocks of `f` x `f` pixels of a flattened image X (C x H*W)
+    """
+    C = X.shape[0]
+    blocks = np.asarray(X).reshape(C, H // f, f, W // f, f)
+    return blocks.mean(axis=(2, 4), dtype=np.float64).reshape(C, -1).astype(X.dtype)
+
+
+def build_pyramid(src, dst, resolutions, compress=False, strip_size=2**24):
+    """
+    Build a pyramid file `dst` from the full resolution `.mat` dataset `src`
+
+    `resolutions` lists the number of lines H of the additional levels.
+    Every level is written by strips of lines of the source. Only v7.3
+    sources are streamed from their memory map, v5 sources are fully loaded.
+    """
+    reader = MatFile(src)
+    H = int(reader.load("H").item())
+    W = int(reader.load("W").item())
+    L = reader.shape("Y")[0]
+
+    factors = {}
+    for res in sorted(set(resolutions) | {H}, reverse=True):
+        if H % res != 0 or W % (H // res) != 0:
+            raise ValueError(f"Resolution {res} does not divide the scene ({H}x{W})")
+        factors[res] = H // res
+
+    # Strips hold a whole number of blocks of every level
+    # NOTE Factors are not necessarily nested (e.g. 3 and 4)
+    period = math.lcm(*factors.values())
+    n_lines = max(1, strip_size // (W * L * period)) * period
+    n_lines = min(n_lines, H)
+    log.debug(f"Pyramid factors => {factors}, strips of {n_lines} lines")
+
+    has_GT = "A" in reader
+    checks = {}
+    options = {"compression": "gzip", "shuffle": True} if compress else {}
+
+    with h5py.File(dst, "w") as h5:
+        for key in filter(lambda k: k in reader, SHARED_VALUES):
+            value = reader.load(key)
+            if value.dtype == object or value.dtype.kind == "U":
+                # NOTE MATLAB cell entries are (1 x n) char arrays
+                value = [str(np.squeeze(v)).strip() for v in value.ravel()]
+                value = np.array(value, dtype=object)
+                h5.create_dataset(key, data=value, dtype=h5py.string_dtype())
+            else:
+                h5.create_dataset(key, data=value)
+            if key == "E":
+                checks["ENC"] = bool(np.all(value >= -EPS))
+
+        for res, factor in factors.items():
+            group = h5.create_group(level_name(res))
+            h, w = H // factor, W // factor
+            for key, value in zip(LEVEL_INTEGERS, (h, w, h * w)):
+                group.attrs[key] = value
+
+        for key in filter(lambda k: k in reader, LEVEL_VALUES):
+            X = reader.load(key)
+            rows = X.shape[0]
+            if key == "A":
+                checks["ANC"] = bool(np.all(X >= -EPS))
+
+            datasets = {}
+            for res, factor in factors.items():
+                n = (H // factor) * (W // factor)
+                # NOTE ~1MB chunks of full columns
+                chunk_cols = min(n, max(1, 2**20 // (rows * X.itemsize)))
+                datasets[res] = h5[level_name(res)].create_dataset(
+                    key,
+                    shape=(rows, n),
+                    dtype=X.dtype,
+                    chunks=(rows, chunk_cols),
+                    **options,
+                )
+
+            for top in range(0, H, n_lines):
+                bottom = min(top + n_lines, H)
+                strip = np.asarray(X[:, top * W : bottom * W])
+                for res, factor in factors.items():
+                    out = block_average(strip, bottom - top, W, factor)
+                    start = top // factor * (W // factor)
+                    datasets[res][:, start : start + out.shape[1]] = out
+            del X
+
+        h5.attrs["version"] = PYRAMID_VERSION
+        h5.attrs["resolutions"] = sorted(factors)
+        h5.attrs["checks"] = json.dumps(checks)
+
+    reader.close()
+    log.info(f"Pyramid {dst} built with levels {sorted(factors)} (GT: {has_GT})")
+    return dst
+
+
+class PyramidFile:
+    """
+    Reader on one level of a pyramid file, exposing the same interface as `MatFile`
+
+    Only the datasets of the requested level are read.
+    """
+
+    def __init__(self, path, level):
+        self.path = path
+        self.level = level
+        self._file = h5py.File(path, "r")
+
+        name = level_name(level)
+        if name not in self._file:
+            levels = [int(res) for res in self._file.attrs["resolutions"]]
+            self._file.close()
+            raise ValueError(f"Level {level} not found in {path} (levels: {levels})")
+        self._group = self._file[name]
+        self.checks = json.loads(self._file.attrs.get("checks", "{}"))
+
+        self._shapes = {key: (1, 1) for key in LEVEL_INTEGERS}
+        self._shapes.update({key: ds.shape for key, ds in self._group.items()})
+        for key in filter(lambda k: k in self._file, SHARED_VALUES):
+            self._shapes[key] = self._file[key].shape
+
+        log.debug(f"Variables found in {path} ({name}): {self._shapes}")
+
+    def keys(self):
+        return self._shapes.keys()
+
+    def __contains__(self, key):
+        return key in self._shapes
+
+    def shape(self, key):
+        return self._shapes[key]
+
+    def load(self, key):
+        log.debug(f"Loading {key} from {self.path} ({level_name(self.level)})")
+        if key in LEVEL_INTEGERS:
+            return np.atleast_2d(self._group.attrs[key])
+        ds = self._group[key] if key in self._group else self._file[key]
+        if h5py.check_string_dtype(ds.dtype) is not None:
+            return ds.asstr()[()]
+        return ds[()]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="HSI pyramid builder")
+    parser.add_argument("--src", required=True, help="Full resolution .mat dataset")
+    parser.add_argument("--dst", required=False, default=None)
+    parser.add_argument("--resolutions", type=int, nargs="+", required=True)
+    parser.add_argument("--compress", action="store_true")
+    args = parser.parse_args()
+
+    dst = args.dst
+    if dst is None:
+        dst = f"{os.path.splitext(args.src)[0]}{PYRAMID_EXT}"
+    build_pyramid(args.src, dst, args.resolutions, compress=args.compress)
@@ -2,17 +2,578 @@
 Utility functions for data manipulation
 """
 
+import hashlib
 import logging
+from collections import namedtuple
+
 import numpy as np
+import scipy.sparse as sp
+
+from .cache import NoisyInputCache
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
-def SVD_projection(Y, p):
+def iter_chunks(Y, chunk_size=2**16):
+    """
+    Iterate over chunks of pixels (columns) of Y (L x N)
+    """
+    for start in range(0, Y.shape[1], chunk_size):
+        yield Y[:, start : start + chunk_size]
+
+
+def fingerprint(Y, chunk_size=2**22):
+    """
+    Content hash of an array (shape, dtype and values)
+
+    Values are hashed in C order whatever the memory layout, so that the
+    same data in C or Fortran order share a key. C-contiguous arrays are
+    hashed in place, other layouts by blocks of about `chunk_size` values.
+    """
+    h = hashlib.sha256(f"{Y.shape}{Y.dtype}".encode())
+    if Y.flags.c_contiguous:
+        h.update(Y.data)
+    else:
+        rows = max(1, chunk_size // max(1, Y[0].size))
+        for start in range(0, Y.shape[0], rows):
+            h.update(np.ascontiguousarray(Y[start : start + rows]).data)
+    return h.hexdigest()
+
+
+class SubspaceEstimator:
+    """
+    Streaming estimate of the principal subspace of the pixels
+
+    The pixel count, sum and L x L second moments are accumulated in float64
+    over chunks of pixels (e.g. memory-mapped or tiled data), so that the
+    subspace is computed in a single pass that can be shared between the
+    projection and the extractors.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum = None
+        self.moment = None
+        self._svd = {}
+
+    def partial_fit(self, Y_chunk):
+        Y_chunk = np.asarray(Y_chunk, dtype=np.float64)
+        if self.sum is None:
+            L = Y_chunk.shape[0]
+            self.sum = np.zeros((L, 1))
+            self.moment = np.zeros((L, L))
+        self.n += Y_chunk.shape[1]
+        self.sum += Y_chunk.sum(axis=1, keepdims=True)
+        self.moment += Y_chunk @ Y_chunk.T
+        self._svd = {}
+        return self
+
+    def fit(self, Y, chunk_size=2**16):
+        """
+        Fit on Y (L x N) or on an iterable of pixels chunks (L x n)
+        """
+        chunks = iter_chunks(Y, chunk_size) if isinstance(Y, np.ndarray) else Y
+        for Y_chunk in chunks:
+            self.partial_fit(Y_chunk)
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.n
+
+    def covariance(self, centered=True):
+        C = self.moment / self.n
+        if centered:
+            C = C - self.mean @ self.mean.T
+        return C
+
+    def _decomposition(self, centered):
+        if centered not in self._svd:
+            U, S, _ = np.linalg.svd(self.covariance(centered))
+            self._svd[centered] = (U, S)
+        return self._svd[centered]
+
+    def Ud(self, d, centered=True):
+        """
+        Leading `d` principal directions (L x d)
+        """
+        return self._decomposition(centered)[0][:, :d]
+
+    def singular_values(self, centered=True):
+        """
+        Singular values of the (centered) second moments matrix
+        """
+        return self._decomposition(centered)[1]
+
+    def project(self, Y_chunk, d, centered=True):
+        """
+        Coordinates (d x n) of a pixels chunk in the leading subspace
+        """
+        Ud = self.Ud(d, centered).astype(Y_chunk.dtype)
+        if centered:
+            Y_chunk = Y_chunk - self.mean.astype(Y_chunk.dtype)
+        return Ud.T @ Y_chunk
+
+
+def _gram_subspace(Y, p, chunk_size):
+    """
+    Leading left singular vectors of Y from the second moments of its pixels
+    """
+    return SubspaceEstimator().fit(Y, chunk_size).Ud(p, centered=False)
+
+
+def _randomized_subspace(Y, p, oversampling=10, power_iters=2, seed=0):
+    """
+    Leading left singular vectors of Y by randomized range finding
+    """
+    L, N = Y.shape
+    k = min(p + oversampling, L)
+    generator = np.random.default_rng(seed)
+    Omega = generator.standard_normal((N, k), dtype=np.float32).astype(Y.dtype)
+    Q, _ = np.linalg.qr(Y @ Omega)
+    for _ in range(power_iters):
+        Q, _ = np.linalg.qr(Y @ (Y.T @ Q))
+    B = Q.T @ Y
+    Ub, _, _ = np.linalg.svd(B @ B.T)
+    return Q @ Ub[:, :p]
+
+
+def _exact_subspace(Y, p):
+    """
+    Leading left singular vectors of Y from its thin SVD
+    """
+    V, _, _ = np.linalg.svd(Y, full_matrices=False)
+    return V[:, :p]
+
+
+def projection_method(Y, p, method="auto"):
+    """
+    Projection strategy of `SVD_projection` for Y (L x N), "auto" resolved
+    """
+    if method != "auto":
+        return method
+    L, N = Y.shape
+    if N <= 2 * L:
+        return "exact"
+    if L > 1000 and p < L // 10:
+        return "randomized"
+    return "gram"
+
+
+def SVD_projection(Y, p, method="auto", chunk_size=2**16, subspace=None):
+    """
+    Project Y (L x N) onto its rank p principal subspace and clip to [0, 1]
+
+    method:
+        - "gram": eigendecomposition of the L x L Gram matrix (N >> L)
+        - "randomized": randomized range finder (large L, small p)
+        - "exact": thin SVD of Y (small images)
+        - "auto": picked from N, L and p
+    A fitted `SubspaceEstimator` can be passed instead (`subspace`).
+    The right singular vectors are never formed, Y is projected by chunks.
+    """
     log.debug(f"Y shape => {Y.shape}")
-    V, SS, U = np.linalg.svd(Y, full_matrices=False)
-    PC = np.diag(SS) @ U
-    denoised_image_reshape = V[:, :p] @ PC[:p]
+    L, N = Y.shape
+    method = projection_method(Y, p, method)
+    log.debug(f"Projection method => {method}")
+
+    if subspace is not None:
+        Ud = subspace.Ud(p, centered=False)
+    elif method == "gram":
+        Ud = _gram_subspace(Y, p, chunk_size)
+    elif method == "randomized":
+        Ud = _randomized_subspace(Y, p)
+    elif method == "exact":
+        Ud = _exact_subspace(Y, p)
+    else:
+        raise ValueError(f"Projection method {method} is invalid")
+
+    Ud = Ud.astype(Y.dtype)
+    denoised_image_reshape = np.empty(Y.shape, dtype=Y.dtype)
+    for start in range(0, N, chunk_size):
+        stop = start + chunk_size
+        denoised_image_reshape[:, start:stop] = Ud @ (Ud.T @ Y[:, start:stop])
     log.debug(f"projected Y shape => {denoised_image_reshape.shape}")
-    return np.clip(denoised_image_reshape, 0, 1)
+    return np.clip(denoised_image_reshape, 0, 1, out=denoised_image_reshape)
+
+
+TileOffsets = namedtuple(
+    "TileOffsets",
+    ["row", "col", "top", "left", "height", "width"],
+)
+TileOffsets.__doc__ = """
+Location of a tile in the full image
+
+row, col: upper-left corner of the tile core in the full image
+top, left: size of the halo above and on the left of the core inside the tile
+height, width: size of the tile core
+"""
+
+
+def _image_view(Y, H, W):
+    """
+    View a flattened HSI (L x N) as an image, avoiding copies
+    """
+    L, N = Y.shape
+    assert N == H * W
+    if Y.flags.f_contiguous and not Y.flags.c_contiguous:
+        # e.g. memory-mapped MATLAB arrays => (H, W, L) layout is free
+        return Y.T.reshape(H, W, L), True
+    return Y.reshape(L, H, W), False
+
+
+def iter_tiles(Y, H, W, tile_h, tile_w, halo=0):
+    """
+    Iterate over spatial tiles of a flattened HSI Y (L x N)
+
+    Each tile core is extended by `halo` pixels on every side (clipped to
+    the image borders) so that spatial methods see their neighbourhood.
+
+    Yields (Y_tile, H_tile, W_tile, offsets) where Y_tile is (L x H_tile*W_tile)
+    and offsets is a `TileOffsets` used by `stitch_tiles`.
+    """
+    img, channels_last = _image_view(Y, H, W)
+    L = Y.shape[0]
+    for row in range(0, H, tile_h):
+        for col in range(0, W, tile_w):
+            height = min(tile_h, H - row)
+            width = min(tile_w, W - col)
+            r0, r1 = max(row - halo, 0), min(row + height + halo, H)
+            c0, c1 = max(col - halo, 0), min(col + width + halo, W)
+            if channels_last:
+                Y_tile = img[r0:r1, c0:c1].reshape(-1, L).T
+            else:
+                Y_tile = img[:, r0:r1, c0:c1].reshape(L, -1)
+            offsets = TileOffsets(row, col, row - r0, col - c0, height, width)
+            yield np.ascontiguousarray(Y_tile), r1 - r0, c1 - c0, offsets
+
+
+def stitch_tiles(tiles, H, W, out=None):
+    """
+    Assemble per-tile abundances into the full (p, H, W) abundances
+
+    tiles: iterable of (A_tile, H_tile, W_tile, offsets) where A_tile is
+    (p x H_tile*W_tile). Halos are cropped before writing.
+    """
+    for A_tile, H_tile, W_tile, offsets in tiles:
+        A_tile = np.asarray(A_tile).reshape(-1, H_tile, W_tile)
+        if out is None:
+            out = np.zeros((A_tile.shape[0], H, W), dtype=A_tile.dtype)
+        out[
+            :,
+            offsets.row : offsets.row + offsets.height,
+            offsets.col : offsets.col + offsets.width,
+        ] = A_tile[
+            :,
+            offsets.top : offsets.top + offsets.height,
+            offsets.left : offsets.left + offsets.width,
+        ]
+    return out
+
+
+def tiled_abundances(
+    model, Y, E, H, W, tile_size, halo=0, deduplicate=False, eps=None, **kwargs
+):
+    """
+    Run `model.compute_abundances` tile by tile and stitch the results
+
+    With `deduplicate`, each tile is solved on its unique pixels
+    (see `deduplicated_abundances`).
+
+    Returns abundances of shape (p x N)
+    """
+
+    def solve(Y_tile, H_tile, W_tile):
+        if deduplicate:
+            return deduplicated_abundances(model, Y_tile, E, eps, **kwargs)
+        return model.compute_abundances(Y_tile, E, H=H_tile, W=W_tile, **kwargs)
+
+    tiles = iter_tiles(Y, H, W, tile_size, tile_size, halo)
+    log.info(f"Tiled abundances estimation (tile size: {tile_size}, halo: {halo})")
+    A = stitch_tiles(
+        (
+            (solve(Y_tile, H_tile, W_tile), H_tile, W_tile, offsets)
+            for Y_tile, H_tile, W_tile, offsets in tiles
+        ),
+        H,
+        W,
+    )
+    return A.reshape(-1, H * W)
+
+
+def unique_pixels(Y, eps=None):
+    """
+    Collapse duplicate pixels spectra of Y (L x N)
+
+    With `eps`, spectra are quantized on a grid of step `eps` before comparison
+    and each group is represented by its mean spectrum.
+
+    Returns (Y_unique, inverse, counts) where Y_unique is (L x K),
+    Y_unique[:, inverse] approximates Y and counts are the group sizes.
+    """
+    L, N = Y.shape
+    keys = np.ascontiguousarray(Y.T)
+    if eps is not None:
+        keys = np.round(keys / eps).astype(np.int64)
+    # NOTE Each spectrum is compared as a single opaque byte string
+    rows = keys.view(np.dtype((np.void, keys.dtype.itemsize * L))).ravel()
+    _, index, inverse, counts = np.unique(
+        rows,
+        return_index=True,
+        return_inverse=True,
+        return_counts=True,
+    )
+    inverse = inverse.ravel()
+
+    if eps is None:
+        Y_unique = Y[:, index]
+    else:
+        sums = np.stack(
+            [np.bincount(inverse, weights=band, minlength=len(index)) for band in Y]
+        )
+        Y_unique = (sums / counts).astype(Y.dtype)
+
+    log.debug(f"{len(index)} unique pixels out of {N}")
+    return np.ascontiguousarray(Y_unique), inverse, counts
+
+
+def deduplicated_abundances(model, Y, E, eps=None, **kwargs):
+    """
+    Run `model.compute_abundances` on the unique pixels of Y and scatter back
+
+    Pixel-wise models solve the unique spectra directly. Models coupling the
+    pixels through a sum over them (`weighted`) are solved on the unique
+    spectra scaled by the square root of their multiplicities.
+
+    Returns abundances of shape (p x N)
+    """
+    assert model.pixelwise or model.weighted, f"{model} cannot run on unique pixels"
+    Y_unique, inverse, counts = unique_pixels(Y, eps)
+    log.info(f"Deduplicated abundances estimation ({Y_unique.shape[1]} unique pixels)")
+    if model.pixelwise:
+        A_unique = model.compute_abundances(Y_unique, E, **kwargs)
+    else:
+        weights = np.sqrt(counts).astype(Y.dtype)
+        A_unique = model.compute_abundances(Y_unique * weights, E, **kwargs) / weights
+    return A_unique[:, inverse]
+
+
+def sparsify(A, threshold=None, top_k=None):
+    """
+    Sparse (CSR) copy of abundances A (M x N)
+
+    threshold: entries with an absolute value below are dropped
+    top_k: only the `top_k` largest entries of each pixel are kept
+    """
+    M, N = A.shape
+    if top_k is not None and top_k < M:
+        rows = np.argpartition(-np.abs(A), top_k - 1, axis=0)[:top_k].ravel()
+        cols = np.tile(np.arange(N), top_k)
+    else:
+        rows, cols = np.nonzero(A)
+    values = A[rows, cols]
+    keep = np.abs(values) > (0 if threshold is None else threshold)
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+    A_sparse = sp.csr_matrix((values, (rows, cols)), shape=(M, N))
+    log.debug(f"Sparse abundances => {A_sparse.nnz} non-zeros ({A_sparse.nnz / (M * N):.2%})")
+    return A_sparse
+
+
+def _normalize_and_project(
+    Y,
+    p,
+    l2_normalization=False,
+    projection=False,
+    fit_subspace=False,
+    method="auto",
+):
+    # L2 normalization
+    if l2_normalization:
+        Y = Y / np.linalg.norm(Y, axis=0, ord=2, keepdims=True)
+    if not projection:
+        # NOTE A single pass over the pixels shared by the extractors
+        return Y, SubspaceEstimator().fit(Y) if fit_subspace else None
+    # Apply SVD projection
+    method = projection_method(Y, p, method)
+    subspace = SubspaceEstimator().fit(Y) if method == "gram" else None
+    Y = SVD_projection(Y, p, method, subspace=subspace)
+    # NOTE The clipping to [0, 1] changes the moments of the projected pixels
+    return Y, SubspaceEstimator().fit(Y) if fit_subspace else None
+
+
+def _inputs_key(store, hsi, noise, SNR, seed, p, l2_normalization, projection, method):
+    return store.key(
+        hsi.sources,
+        level=hsi.level,
+        dtype=str(hsi.dtype),
+        noise=noise.__class__.__name__,
+        SNR=SNR,
+        seed=seed,
+        l2_normalization=l2_normalization,
+        projection=p if projection else None,
+        projection_method=method if projection else None,
+    )
+
+
+def _cacheable(SNR, seed, l2_normalization, projection):
+    # NOTE Noise drawn without a seed is not reproducible
+    if SNR is not None and seed is None:
+        return False
+    return SNR is not None or l2_normalization or projection
+
+
+def preprocess(
+    hsi,
+    noise,
+    p,
+    l2_normalization=False,
+    projection=False,
+    cache=False,
+    seed=None,
+    fit_subspace=False,
+    projection_method="auto",
+):
+    """
+    Noisy (and optionally L2 normalized and SVD projected) input HSI
+
+    The noise is drawn from the noise seed, or from `seed` when the noise
+    has no seed of its own, as in `preprocess_sweep`. With `cache`, inputs
+    are stored in a `NoisyInputCache` keyed by the dataset content, noise
+    configuration, seed and preprocessing options.
+
+    Returns (Y, subspace) where `subspace` is the `SubspaceEstimator` of Y,
+    fitted with `fit_subspace` only (None otherwise). The projection uses
+    `projection_method` (see `SVD_projection`).
+    """
+
+    # NOTE The global seed drives the noise when it has no seed of its own
+    noise_seed = getattr(noise, "seed", None)
+    seed = seed if noise_seed is None else noise_seed
+
+    def build():
+        # Apply noise
+        Y = noise.apply(hsi.Y, seed=seed)
+        return _normalize_and_project(
+            Y, p, l2_normalization, projection, fit_subspace, projection_method
+        )
+
+    if not cache or not _cacheable(noise.SNR, seed, l2_normalization, projection):
+        return build()
+
+    store = NoisyInputCache(hsi.data_dir)
+    key = _inputs_key(
+        store,
+        hsi,
+        noise,
+        noise.SNR,
+        seed,
+        p,
+        l2_normalization,
+        projection,
+        projection_method,
+    )
+    Y = store.load(key)
+    if Y is not None:
+        Y = np.asarray(Y)
+        return Y, SubspaceEstimator().fit(Y) if fit_subspace else None
+    Y, subspace = build()
+    return np.asarray(store.save(key, Y)), subspace
+
+
+def preprocess_sweep(
+    hsi,
+    noise,
+    p,
+    SNRs=None,
+    seeds=None,
+    l2_normalization=False,
+    projection=False,
+    cache=False,
+    seed=None,
+    fit_subspace=False,
+    projection_method="auto",
+):
+    """
+    Lazily yield (SNR, seed, input HSI, subspace) for every (SNR, seed) pair
+
+    The noisy cubes are drawn by `noise.sweep` from a single load of the
+    data, with the same generators as `preprocess` (a cached single run and
+    a sweep share their inputs). Without `SNRs`, the single input of
+    `preprocess` is yielded.
+    """
+    if SNRs is None:
+        Y, subspace = preprocess(
+            hsi,
+            noise,
+            p,
+            l2_normalization,
+            projection,
+            cache,
+            seed,
+            fit_subspace,
+            projection_method,
+        )
+        yield noise.SNR, seed, Y, subspace
+        return
+
+    if seeds is None:
+        noise_seed = getattr(noise, "seed", None)
+        seeds = [seed if noise_seed is None else noise_seed]
+    store = NoisyInputCache(hsi.data_dir) if cache else None
+    for seed in seeds:
+        keys, cached = {}, {}
+        for SNR in SNRs:
+            if store is None or not _cacheable(SNR, seed, l2_normalization, projection):
+                continue
+            keys[SNR] = _inputs_key(
+                store,
+                hsi,
+                noise,
+                SNR,
+                seed,
+                p,
+                l2_normalization,
+                projection,
+                projection_method,
+            )
+            cached[SNR] = store.load(keys[SNR])
+        # NOTE A single standard normal draw is shared by the SNRs not cached
+        missing = [SNR for SNR in SNRs if cached.get(SNR) is None]
+        noisy = noise.sweep(hsi.Y, missing, [seed])
+        for SNR in SNRs:
+            if cached.get(SNR) is not None:
+                Y = np.asarray(cached[SNR])
+                subspace = SubspaceEstimator().fit(Y) if fit_subspace else None
+                yield SNR, seed, Y, subspace
+                continue
+            _, _, Y = next(noisy)
+            Y, subspace = _normalize_and_project(
+                Y, p, l2_normalization, projection, fit_subspace, projection_method
+            )
+            if SNR in keys:
+                Y = np.asarray(store.save(keys[SNR], Y))
+            yield SNR, seed, Y, subspace
+
+
+def subspace_reduce(Y, E, rank=None, tol=1e-10):
+    """
+    Express Y (L x N) and E (L x M) in an orthonormal basis Q of the range of E
+
+    Since ||Y - E A||^2 = ||Q^T Y - Q^T E A||^2 + ||(I - Q Q^T) Y||^2,
+    least squares problems in A (whatever the constraints on A) keep the same
+    solutions on the k x N coordinates when k = rank(E).
+    A smaller `rank` truncates the basis (approximation).
+
+    Returns (Y_k, E_k, Q)
+    """
+    U, S, Vt = np.linalg.svd(np.asarray(E, dtype=np.float64), full_matrices=False)
+    k = int(np.sum(S > tol * S[0]))
+    if rank is not None and rank < k:
+        log.warning(f"Subspace truncated to rank {rank} (rank of E: {k})")
+        k = rank
+    Q = U[:, :k]
+    E_k = (S[:k, np.newaxis] * Vt[:k]).astype(E.dtype)
+    Y_k = Q.T.astype(Y.dtype) @ Y
+    log.info(f"Solving in a {k}-dimensional subspace ({Y.shape[0]} bands)")
+    return Y_k, E_k, Q
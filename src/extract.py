@@ -1,90 +1,187 @@
 """
 Endmembers extraction techniques main source file
+
+Every configured extractor is run on every spatial tile of the HSI, one job
+per (tile, extractor) in a process pool. Candidates are clustered on the fly
+with mini-batch k-means in p clusters. The candidates library `D`, the
+index of the candidate closest to each cluster center `index` (p atoms) and
+the cluster labels of the candidates `clusters` are saved to
+`<DATA_dir>/<dataset>-<M>.mat`.
 """
 import logging
-
-from hydra.utils import instantiate
-
-from src.model.extractors import VCA, SiVM
-from sklearn.cluster import KMeans
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import mlxp
+from mlxp.launcher import _instance_from_config
+from omegaconf import OmegaConf
+from sklearn.cluster import MiniBatchKMeans
 import numpy as np
-
 import matplotlib.pyplot as plt
 import scipy.io as sio
-from hydra.utils import to_absolute_path
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+from src.data.utils import iter_tiles
 
+log = logging.getLogger(__name__)
 
-def main(cfg):
-    logger.debug("Endmember extraction --- start...")
 
-    # Instantiate objects
-    extractors = [
-        VCA(),
-        SiVM(),
-        # SISAL(),
-    ]
-
-    hsi = instantiate(
-        cfg.data,
-        noise=None,
+def extract_tile(extractor_cfg, Y_tile, p, seed, snr_input):
+    """
+    Candidate endmembers (L x p) of a tile (job run in a worker process)
+    """
+    extractor = _instance_from_config(extractor_cfg)
+    return extractor.extract_endmembers(
+        Y=Y_tile,
+        p=p,
+        seed=seed,
+        snr_input=snr_input,
     )
 
-    Y, p, H, W, N, L = hsi.get_endmembers_extraction_input()
+
+def iter_candidates(jobs, workers):
+    """
+    Yield the candidates of the jobs (args of `extract_tile`) in order
+
+    At most 2 jobs per worker are in flight so that tiles are not all
+    copied to the workers at once. Candidates are yielded in the order of
+    the jobs so that the library does not depend on the scheduling.
+    """
+    if workers == 1:
+        for args in jobs:
+            yield extract_tile(*args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for args in jobs:
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(extract_tile, *args))
+        while pending:
+            yield pending.popleft().result()
+
+
+class CandidatesClusterer:
+    """
+    Mini-batch k-means fed with candidates (L x n) as they arrive
+    """
+
+    def __init__(self, n_clusters, batch_size, seed=0):
+        self.n_clusters = n_clusters
+        self.batch_size = max(batch_size, n_clusters)
+        self.kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            batch_size=self.batch_size,
+            random_state=seed,
+            n_init=1,
+        )
+        self.fitted = False
+        self._buffer = []
+        self._count = 0
+
+    def partial_fit(self, candidates):
+        self._buffer.append(candidates.T)
+        self._count += candidates.shape[1]
+        if self._count >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        # NOTE The first update needs at least `n_clusters` samples
+        if self._count == 0 or (not self.fitted and self._count < self.n_clusters):
+            return
+        self.kmeans.partial_fit(np.vstack(self._buffer))
+        self.fitted = True
+        self._buffer = []
+        self._count = 0
+
+    def predict(self, candidates):
+        self._flush()
+        if not self.fitted:
+            raise ValueError(
+                f"Not enough candidates ({self._count}) for {self.n_clusters} clusters"
+            )
+        return self.kmeans.predict(candidates.T)
+
+    def nearest(self, candidates):
+        """
+        Index of the candidate closest to each cluster center
+        """
+        centers = self.kmeans.cluster_centers_
+        distances = (
+            np.sum(centers**2, axis=1, keepdims=True)
+            - 2 * centers @ candidates
+            + np.sum(candidates**2, axis=0)
+        )
+        return np.argmin(distances, axis=1)
+
+
+def main(ctx: mlxp.Context) -> None:
+    log.info("Endmembers extraction - [START]...")
+
+    cfg = ctx.config
+
+    # Get HSI
+    hsi = _instance_from_config(cfg.data)
+    # Print HSI information
+    log.info(hsi)
+    # Get data
+    Y, p, _ = hsi.get_data()
+    # Get image dimensions
+    H, W = hsi.get_img_shape()
+    L = Y.shape[0]
 
     # Rescale Y
     Y = (Y - Y.min()) / (Y.max() - Y.min())
 
-    Y_img = Y.reshape(L, H, W)
-
-    rows_division = 4
-    cols_division = 4
-    nH = H // rows_division
-    nW = W // cols_division
+    # Jobs: every extractor on every tile
+    rows_division, cols_division = cfg.extract_grid
+    tile_h = -(-H // rows_division)
+    tile_w = -(-W // cols_division)
+    extractors = [
+        OmegaConf.to_container(extractor, resolve=True)
+        for extractor in cfg.extract_extractors
+    ]
+    log.info(
+        f"{len(extractors)} extractor(s) on {rows_division}x{cols_division} tiles"
+    )
+    jobs = (
+        (extractor, Y_tile, p, cfg.seed, cfg.extract_snr_input)
+        for Y_tile, _, _, _ in iter_tiles(Y, H, W, tile_h, tile_w)
+        for extractor in extractors
+    )
+    workers = cfg.extract_workers or os.cpu_count()
 
+    # Aggregate endmembers while clustering them
+    clusterer = CandidatesClusterer(p, cfg.extract_batch_size, seed=cfg.seed)
     candidates = []
+    for E_tile in iter_candidates(jobs, workers):
+        candidates.append(E_tile)
+        clusterer.partial_fit(E_tile)
 
-    for ii in range(rows_division):
-        for jj in range(cols_division):
-
-            # Sub-images creation
-            sub_img = Y_img[:, nH * ii : nH * (ii + 1), nW * jj : nW * (jj + 1)]
-            sub_img_flattened = sub_img.reshape(L, -1)
-
-            # Endmembers extraction
-            for extractor in extractors:
-                candidates.append(
-                    extractor.extract_endmembers(
-                        Y=sub_img_flattened,  # Use sub-images here
-                        p=p,
-                        seed=0,
-                        snr_input=100,
-                    )
-                )
-    # Aggregate endmembers
-    candidates = np.hstack(candidates)  # (L, p x rows_div x cols_div x nb_extractors)
-    kmeans_input = candidates.T  # (n_samples, n_features)
-
-    # Use k-means
-    kmeans = KMeans(n_clusters=p).fit(kmeans_input)
-    indices = kmeans.labels_
+    # (L, p x rows_div x cols_div x nb_extractors)
+    candidates = np.hstack(candidates)
+    clusters = clusterer.predict(candidates)
+    # NOTE One atom per cluster drives the semi-supervised evaluation
+    index = clusterer.nearest(candidates)
+    M = len(clusters)
 
     # Dictionary creation
-    logger.info(f"Dictionary shape => {candidates.shape}")
-
-    color_dict = {0: "b", 1: "g", 2: "r", 3: "k"}
-    for cc in range(len(indices)):
-        plt.plot(kmeans_input[cc], c=color_dict[indices[cc]])
-    plt.show()
-
-    M = len(indices)
-
-    breakpoint()
-    sio.savemat(
-        to_absolute_path(f"data/{cfg.data.name}-{M}.mat"),
-        {"D": candidates, "index": indices},
-    )
-
-    logger.debug("Endmembers extraction --- end...")
+    log.info(f"Dictionary shape => {candidates.shape}")
+
+    colors = plt.get_cmap("tab20")
+    plt.figure(figsize=(6, 6))
+    for cc in range(M):
+        plt.plot(candidates[:, cc], c=colors(clusters[cc] % colors.N), lw=0.5)
+    plt.title(f"{hsi.name} - {M} candidates ({p} clusters)")
+    plt.xlabel("# Bands")
+    plt.ylabel("Reflectance")
+    plt.savefig(os.path.join(hsi.figs_dir, f"{hsi.name}-{M}-candidates.png"))
+    plt.close()
+
+    path = os.path.join(cfg.DATA_dir, f"{hsi.name}-{M}.mat")
+    data = {"D": candidates, "index": index, "clusters": clusters, "L": L, "M": M}
+    sio.savemat(path, data)
+    log.info(f"Library saved to {path}")
+
+    log.info("Endmembers extraction - [END]...")
@@ -1,8 +1,22 @@
 """
 Model related globals
 """
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
 
 class UnmixingModel:
+    # Abundances of a pixel only depend on its own spectrum
+    pixelwise = False
+    # Pixels are coupled through a sum over them, so that duplicate pixels can
+    # be replaced by a single pixel scaled by the square root of its multiplicity
+    weighted = False
+    # Data fidelity is a least squares term ||Y - E A||^2, solutions are kept
+    # when Y and E are expressed in an orthonormal basis of the range of E
+    least_squares = False
+
     def __init__(self):
         self.time = 0
 
@@ -12,3 +26,77 @@ class UnmixingModel:
 
     def print_time(self):
         return f"{self} took {self.time:.2f}s"
+
+
+class ConvergenceMonitor:
+    """
+    Early stopping of iterative solvers once their estimate is stable
+
+    Every `window` iterations, the monitor compares:
+        - the estimate (e.g. the averaged abundances) to the one of the
+        previous check (relative change of the Frobenius norm),
+        - the best loss over the window to the best loss so far (plateau),
+        the best loss is used as the loss of stochastic solvers oscillates.
+    Solving stops when the relative change of the estimate and the relative
+    improvement of the loss are below `tol` and `loss_tol` for `patience`
+    consecutive checks, and not before `min_iters` iterations.
+
+    Estimates are only kept by reference: they must not be modified in place
+    by the solver (numpy arrays or torch tensors).
+    """
+
+    def __init__(
+        self,
+        tol=1e-3,
+        loss_tol=1e-3,
+        window=100,
+        patience=3,
+        min_iters=1000,
+    ):
+        assert window > 0, "Window must be strictly positive"
+        assert patience > 0, "Patience must be strictly positive"
+        self.tol = tol
+        self.loss_tol = loss_tol
+        self.window = window
+        self.patience = patience
+        self.min_iters = min_iters
+        self.reset()
+
+    def reset(self):
+        self.stopped_at = None
+        self._estimate = None
+        self._best = None
+        self._window_best = float("inf")
+        self._count = 0
+
+    @staticmethod
+    def relative_change(new, old):
+        norm = float((old**2).sum()) ** 0.5
+        return float(((new - old) ** 2).sum()) ** 0.5 / (norm + 1e-12)
+
+    def update(self, ii, loss, estimate):
+        """
+        Record iteration `ii` (0-based) and return True when solving should stop
+        """
+        self._window_best = min(self._window_best, loss)
+        if (ii + 1) % self.window != 0:
+            return False
+
+        loss, self._window_best = self._window_best, float("inf")
+        if self._estimate is not None:
+            change = self.relative_change(estimate, self._estimate)
+            improvement = (self._best - loss) / (abs(self._best) + 1e-12)
+            stable = change < self.tol and improvement < self.loss_tol
+            self._count = self._count + 1 if stable else 0
+            logger.debug(
+                f"Iteration {ii + 1}: estimate change {change:.2e}, "
+                f"loss improvement {improvement:.2e}"
+            )
+        self._estimate = estimate
+        self._best = loss if self._best is None else min(self._best, loss)
+
+        if self._count >= self.patience and ii + 1 >= self.min_iters:
+            self.stopped_at = ii + 1
+            logger.info(f"Converged after {self.stopped_at} iterations")
+            return True
+        return False
@@ -65,7 +65,7 @@ class ArchetypalAnalysis(BlindUnmixingModel):
         Source: http://thoth.inrialpes.fr/people/mairal/spams/doc-python/html/doc_spams004.html#sec8
         """
         tic = time.time()
-        Yf = np.asfortranarray(Y, dtype=np.float64)
+        Yf = np.asfortranarray(Y)
 
         Ehat, Asparse, Bsparse = spams.archetypalAnalysis(
             Yf,
@@ -150,7 +150,7 @@ class EDAA(BlindUnmixingModel):
         #     Y = Y / np.linalg.norm(Y, axis=0, ord=2, keepdims=True)
 
         # Convert data to tensor
-        Y = torch.Tensor(Y)
+        Y = torch.as_tensor(Y, dtype=torch.float32).contiguous()
 
         for m in tqdm(range(self.M)):
             torch.manual_seed(m + seed)
@@ -13,7 +13,7 @@ import torch.nn.functional as F
 from .base import BlindUnmixingModel
 
 from src import EPS
-from src.extract import VCA
+from src.model.extractors import VCA
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -161,7 +161,8 @@ class ADMMNet(nn.Module, BlindUnmixingModel):
         self = self.to(self.device)
 
         optimizer = torch.optim.Adam(self.parameters(), lr=self.lr)
-        train_db = torch.utils.data.TensorDataset(torch.Tensor(Y.T))
+        Y_t = torch.as_tensor(Y.T, dtype=torch.float32).contiguous()
+        train_db = torch.utils.data.TensorDataset(Y_t)
         dataloader = torch.utils.data.DataLoader(
             train_db,
             batch_size=self.batchsize,
@@ -193,7 +194,7 @@ class ADMMNet(nn.Module, BlindUnmixingModel):
 
         self.eval()
         with torch.no_grad():
-            abund, _ = self(torch.Tensor(Y.T).to(self.device))
+            abund, _ = self(Y_t.to(self.device))
             Ahat = abund.cpu().numpy().T
             Ehat = self.decoder.weight.detach().cpu().numpy()
 
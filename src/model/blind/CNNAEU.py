@@ -154,7 +154,10 @@ class CNNAEU(nn.Module, BlindUnmixingModel):
         # Get final abundances and endmembers
         self.eval()
 
-        Y_eval = torch.Tensor(Y.reshape((1, num_channels, h, w))).to(self.device)
+        Y_eval = torch.as_tensor(
+            Y.reshape((1, num_channels, h, w)),
+            dtype=torch.float32,
+        ).to(self.device)
 
         abund, _ = self(Y_eval)
 
@@ -228,7 +228,7 @@ class MSNet(nn.Module, BlindUnmixingModel):
 
         num_channels, h, w = self.L, self.H, self.W
 
-        Y = torch.Tensor(Y)
+        Y = torch.as_tensor(Y, dtype=torch.float32).contiguous()
         Y = Y.view(1, num_channels, h, w)
 
         self = self.to(self.device)
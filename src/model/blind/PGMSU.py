@@ -187,7 +187,8 @@ class PGMSU(nn.Module, BlindUnmixingModel):
         self.init_architecture(seed=seed)
 
         # Process data
-        train_db = torch.utils.data.TensorDataset(torch.Tensor(Y.T))
+        Y_t = torch.as_tensor(Y.T, dtype=torch.float32).contiguous()
+        train_db = torch.utils.data.TensorDataset(Y_t)
         dataloader = torch.utils.data.DataLoader(
             train_db,
             batch_size=self.batchsz,
@@ -263,7 +264,7 @@ class PGMSU(nn.Module, BlindUnmixingModel):
 
         self.eval()
         with torch.no_grad():
-            y_hat, mu, log_var, A, E = self(torch.Tensor(Y.T).to(self.device))
+            y_hat, mu, log_var, A, E = self(Y_t.to(self.device))
             # breakpoint()
             Ahat = A.cpu().numpy().T
             # E shape => [N, p, L] ??
@@ -66,8 +66,8 @@ class NMFQMV(BlindUnmixingModel):
             nargout=3,
         )
 
-        Ehat = np.array(Ehat).astype(np.float32)
-        Ahat = np.array(Ahat).astype(np.float32)
+        Ehat = np.array(Ehat).astype(Y.dtype)
+        Ahat = np.array(Ahat).astype(Y.dtype)
 
         tac = time.time()
         self.time = round(tac - tic, 2)
@@ -129,11 +129,11 @@ class BayesianSMA(BlindUnmixingModel):
 
         # Process output
         Nmc = int(Nmc)
-        Tab_A = np.array(Tab_A).astype(np.float32)
-        Tab_T = np.array(Tab_T).astype(np.float32)
-        Tab_sigma2 = np.array(Tab_sigma2).astype(np.float32)
-        matU = np.array(matU).astype(np.float32)
-        Y_bar = np.array(Y_bar).astype(np.float32)
+        Tab_A = np.array(Tab_A).astype(Y.dtype)
+        Tab_T = np.array(Tab_T).astype(Y.dtype)
+        Tab_sigma2 = np.array(Tab_sigma2).astype(Y.dtype)
+        matU = np.array(matU).astype(Y.dtype)
+        Y_bar = np.array(Y_bar).astype(Y.dtype)
 
         Nbi = Nmc // 3
         Ahat = np.mean(Tab_A[Nbi:], 0)
@@ -181,11 +181,11 @@ class SCLSU(BlindUnmixingModel):
             nargout=2,
         )
 
-        Ahat = np.array(Ahat).astype(np.float32)
-        psi = np.array(psi).astype(np.float32)
+        Ahat = np.array(Ahat).astype(Y.dtype)
+        psi = np.array(psi).astype(Y.dtype)
 
         # Process output
-        E_full = np.zeros((L, p, N))
+        E_full = np.zeros((L, p, N), dtype=Y.dtype)
         for ii in range(N):
             E_full[:, :, ii] = E0 @ np.diag(psi[:, ii])
 
@@ -274,9 +274,9 @@ class ELMM(BlindUnmixingModel):
         )
 
         # Process output
-        Ahat = np.array(A_ELMM).astype(np.float32)
-        psis_ELMM = np.array(psis_ELMM).astype(np.float32)
-        E_ELMM = np.array(E_ELMM).astype(np.float32)
+        Ahat = np.array(A_ELMM).astype(Y.dtype)
+        psis_ELMM = np.array(psis_ELMM).astype(Y.dtype)
+        E_ELMM = np.array(E_ELMM).astype(Y.dtype)
 
         Ehat = E_ELMM.mean(2)
 
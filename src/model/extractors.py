@@ -6,11 +6,14 @@ import logging
 import warnings
 import os
 import time
+from collections import OrderedDict
 
 import numpy as np
 import numpy.linalg as LA
 import numpy.linalg as lin
 
+from src.data.utils import SubspaceEstimator, fingerprint
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -21,9 +24,50 @@ except Exception:
     warnings.warn("matlab.engine was not imported. MATLAB code will not work")
 
 
+def pixel_purity_coreset(Y, p, n_skewers=1000, seed=0, subspace=None, chunk_size=2**16):
+    """
+    Candidate extreme pixels of Y (L x N) found by pixel purity index
+
+    Pixels are projected onto the (p-1)-dimensional centered subspace and
+    only the extreme pixels along `n_skewers` random directions are kept.
+    Returns the sorted indices of these pixels.
+    """
+    if subspace is None:
+        subspace = SubspaceEstimator().fit(Y, chunk_size)
+    d = max(p - 1, 1)
+    generator = np.random.default_rng(seed=seed)
+    skewers = generator.standard_normal((d, n_skewers))
+    skewers = (skewers / np.linalg.norm(skewers, axis=0)).astype(Y.dtype)
+
+    high = np.full(n_skewers, -np.inf)
+    low = np.full(n_skewers, np.inf)
+    argmax = np.zeros(n_skewers, dtype=int)
+    argmin = np.zeros(n_skewers, dtype=int)
+    # NOTE Bound the n_skewers x chunk projections to ~16M values
+    chunk_size = max(1, min(chunk_size, 2**24 // n_skewers))
+    for start in range(0, Y.shape[1], chunk_size):
+        proj = skewers.T @ subspace.project(Y[:, start : start + chunk_size], d)
+        for extreme, arg, better, pick in (
+            (high, argmax, np.greater, np.argmax),
+            (low, argmin, np.less, np.argmin),
+        ):
+            idx = pick(proj, axis=1)
+            values = proj[np.arange(n_skewers), idx]
+            mask = better(values, extreme)
+            extreme[mask] = values[mask]
+            arg[mask] = start + idx[mask]
+
+    indices = np.unique(np.concatenate((argmax, argmin)))
+    logger.debug(f"Coreset of {indices.size} pixels out of {Y.shape[1]}")
+    return indices
+
+
 class BaseExtractor:
-    def __init__(self):
+    def __init__(self, coreset=None):
         self.seed = None
+        # NOTE Number of random skewers of the pixel purity coreset
+        # prefilter (None: search over all pixels)
+        self.coreset = coreset
 
     def extract_endmembers(self, Y, p, seed=0, *args, **kwargs):
         return NotImplementedError
@@ -45,7 +89,7 @@ class RandomPositiveMatrix(BaseExtractor):
         L, N = Y.shape
         self.seed = seed
         generator = np.random.default_rng(seed=self.seed)
-        return generator.random(size=(L, p))
+        return generator.random(size=(L, p), dtype=Y.dtype)
 
 
 class RandomPixels(BaseExtractor):
@@ -63,13 +107,24 @@ class RandomPixels(BaseExtractor):
 
 
 class VCA(BaseExtractor):
-    def __init__(self):
-        super().__init__()
+    # NOTE Results memoized per (data fingerprint, p, seed, snr_input)
+    # so that repeated initializations on the same data are free
+    memo_size = 16
+    _memo = OrderedDict()
+
+    def __init__(self, coreset=None):
+        super().__init__(coreset)
 
-    def extract_endmembers(self, Y, p, seed=0, snr_input=0, *args, **kwargs):
+    def extract_endmembers(
+        self, Y, p, seed=0, snr_input=0, subspace=None, *args, **kwargs
+    ):
         """
         Vertex Component Analysis
 
+        A `SubspaceEstimator` already fitted on Y can be shared (`subspace`).
+        With a coreset, the moments are still computed on all pixels and only
+        the vertices search is restricted to the candidate extreme pixels.
+
         This code is a translation of a matlab code provided by
         Jose Nascimento (zen@isel.pt) and Jose Bioucas Dias (bioucas@lx.it.pt)
         available at http://www.lx.it.pt/~bioucas/code.htm
@@ -82,24 +137,48 @@ class VCA(BaseExtractor):
         "Vertex Component Analysis: A Fast Algorithm to Unmix Hyperspectral Data"
         submited to IEEE Trans. Geosci. Remote Sensing, vol. .., no. .., pp. .-., 2004
         """
-        L, N = Y.shape
         self.seed = seed
-        generator = np.random.default_rng(seed=self.seed)
+
+        # Unseeded runs are not reproducible and thus not memoized
+        key = None
+        if seed is not None:
+            key = (fingerprint(Y), p, seed, snr_input, self.coreset)
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.indices, E = self._memo[key]
+                logger.debug(f"VCA memoized indices: {self.indices}")
+                return E.copy()
+
+        if self.coreset is None:
+            self.indices, E = self._extract(Y, p, seed, snr_input, subspace)
+        else:
+            if subspace is None:
+                subspace = SubspaceEstimator().fit(Y)
+            candidates = pixel_purity_coreset(Y, p, self.coreset, seed, subspace)
+            indices, E = self._extract(Y[:, candidates], p, seed, snr_input, subspace)
+            self.indices = candidates[indices]
+
+        if key is not None:
+            self._memo[key] = (self.indices, E.copy())
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return E
+
+    def _extract(self, Y, p, seed, snr_input, subspace):
+        L, N = Y.shape
+        generator = np.random.default_rng(seed=seed)
+
+        # NOTE Centered and uncentered second moments from a single pass
+        if subspace is None:
+            subspace = SubspaceEstimator().fit(Y)
 
         #############################################
         # SNR Estimates
         #############################################
 
         if snr_input == 0:
-            y_m = np.mean(Y, axis=1, keepdims=True)
-            Y_o = Y - y_m  # data with zero-mean
-            Ud = LA.svd(np.dot(Y_o, Y_o.T) / float(N))[0][
-                :, :p
-            ]  # computes the R-projection matrix
-            x_p = np.dot(Ud.T, Y_o)  # project the zero-mean data onto p-subspace
-
-            SNR = self.estimate_snr(Y, y_m, x_p)
-
+            # NOTE Signal powers read from the second moments (no projection)
+            SNR = self.estimate_snr(subspace, p)
             logger.info(f"SNR estimated = {SNR}[dB]")
         else:
             SNR = snr_input
@@ -115,36 +194,23 @@ class VCA(BaseExtractor):
             logger.info("... Select proj. to R-1")
 
             d = p - 1
-            if snr_input == 0:  # it means that the projection is already computed
-                Ud = Ud[:, :d]
-            else:
-                y_m = np.mean(Y, axis=1, keepdims=True)
-                Y_o = Y - y_m  # data with zero-mean
-
-                Ud = LA.svd(np.dot(Y_o, Y_o.T) / float(N))[0][
-                    :, :d
-                ]  # computes the p-projection matrix
-                x_p = np.dot(Ud.T, Y_o)  # project thezeros mean data onto p-subspace
+            y_m = subspace.mean.astype(Y.dtype)
+            # computes the (p-1)-projection matrix
+            Ud = subspace.Ud(d).astype(Y.dtype)
+            # project the zero-mean data onto the (p-1)-subspace (no centered copy)
+            x = Ud.T @ Y - Ud.T @ y_m
 
-            Yp = np.dot(Ud, x_p[:d, :]) + y_m  # again in dimension L
-
-            x = x_p[:d, :]  #  x_p =  Ud.T * Y_o is on a R-dim subspace
             c = np.amax(np.sum(x**2, axis=0)) ** 0.5
-            y = np.vstack((x, c * np.ones((1, N))))
+            y = np.vstack((x, c * np.ones((1, N), dtype=x.dtype)))
         else:
             logger.info("... Select the projective proj.")
 
             d = p
-            Ud = LA.svd(np.dot(Y, Y.T) / float(N))[0][
-                :, :d
-            ]  # computes the p-projection matrix
-
-            x_p = np.dot(Ud.T, Y)
-            Yp = np.dot(
-                Ud, x_p[:d, :]
-            )  # again in dimension L (note that x_p has no null mean)
+            y_m = None
+            # computes the p-projection matrix
+            Ud = subspace.Ud(d, centered=False).astype(Y.dtype)
 
-            x = np.dot(Ud.T, Y)
+            x = Ud.T @ Y
             u = np.mean(x, axis=1, keepdims=True)  # equivalent to  u = Ud.T * r_m
             y = x / np.dot(u.T, x)
 
@@ -153,89 +219,110 @@ class VCA(BaseExtractor):
         #############################################
 
         indices = np.zeros((p), dtype=int)
-        A = np.zeros((p, p))
-        A[-1, 0] = 1
+        # NOTE Row i holds the i-th (p, 1) draw of the sequential version
+        directions = generator.random(size=(p, p))
+        # Orthonormal basis of the selected vertices, initialized with e_p
+        Q = np.zeros((p, 1))
+        Q[-1, 0] = 1
 
         for i in range(p):
-            w = generator.random(size=(p, 1))
-            f = w - np.dot(A, np.dot(LA.pinv(A), w))
+            w = directions[i][:, np.newaxis]
+            f = w - Q @ (Q.T @ w)
             f = f / np.linalg.norm(f)
 
             v = np.dot(f.T, y)
 
             indices[i] = np.argmax(np.absolute(v))
-            A[:, i] = y[:, indices[i]]  # same as x(:,indice(i))
+            Q = self._expand(Q if i > 0 else Q[:, :0], y[:, indices[i]])
 
-        E = Yp[:, indices]
+        # NOTE Only the selected columns are mapped back to dimension L
+        E = Ud @ x[:, indices]
+        if y_m is not None:
+            E += y_m
 
         logger.debug(f"Indices chosen to be the most pure: {indices}")
-        self.indices = indices
 
-        return E
+        return indices, E
 
     @staticmethod
-    def estimate_snr(Y, r_m, x):
-        L, N = Y.shape  # L number of bands (channels), N number of pixels
-        p, N = x.shape  # p number of endmembers (reduced dimension)
+    def _expand(Q, a, rtol=1e-12):
+        """
+        Add a vertex to the orthonormal basis Q (Gram-Schmidt, twice)
+        """
+        a = np.asarray(a, dtype=np.float64)[:, np.newaxis]
+        norm = np.linalg.norm(a)
+        for _ in range(2):
+            a = a - Q @ (Q.T @ a)
+        # NOTE Vertices already in the span are skipped (as with pinv)
+        if np.linalg.norm(a) <= rtol * norm:
+            return Q
+        return np.hstack((Q, a / np.linalg.norm(a)))
 
-        P_y = np.sum(Y**2) / float(N)
-        P_x = np.sum(x**2) / float(N) + np.sum(r_m**2)
+    @staticmethod
+    def estimate_snr(subspace, p):
+        L = subspace.moment.shape[0]  # L number of bands (channels)
+
+        P_y = np.trace(subspace.covariance(centered=False))
+        P_x = np.sum(subspace.singular_values()[:p]) + np.sum(subspace.mean**2)
+        if P_y - P_x <= 0:
+            # NOTE Noiseless data (e.g. projected onto p dimensions)
+            return np.inf
         snr_est = 10 * np.log10((P_x - p / L * P_y) / (P_y - P_x))
 
         return snr_est
 
 
 class SiVM(BaseExtractor):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, chunk_size=2**16, coreset=None):
+        super().__init__(coreset)
+        self.chunk_size = chunk_size
 
-    @staticmethod
-    def Eucli_dist(x, y):
-        a = np.subtract(x, y)
-        return np.dot(a.T, a)
+    def sq_distances(self, x, y):
+        """
+        Squared euclidean distances between the pixels of x (D x N) and y (D,)
+        """
+        N = x.shape[1]
+        d = np.empty(N)
+        for start in range(0, N, self.chunk_size):
+            a = x[:, start : start + self.chunk_size] - y[:, np.newaxis]
+            d[start : start + a.shape[1]] = np.einsum("ij,ij->j", a, a)
+        return d
+
+    def volumes(self, d, D4):
+        """
+        Quadratic forms [d_i, 1] D4 [d_i, 1]^T over all pixels i
+        """
+        v, N = d.shape
+        V = np.empty(N)
+        for start in range(0, N, self.chunk_size):
+            D3 = np.ones((v + 1, min(self.chunk_size, N - start)))
+            D3[:v] = d[:, start : start + self.chunk_size]
+            V[start : start + D3.shape[1]] = np.einsum("ij,ij->j", D3, D4 @ D3)
+        return V
 
     def extract_endmembers(self, Y, p, seed=0, *args, **kwargs):
 
         x, p = Y, p
+        if self.coreset is not None:
+            x = x[:, pixel_purity_coreset(x, p, self.coreset, seed, None, self.chunk_size)]
 
         [D, N] = x.shape
-        # If no distf given, use Euclidean distance function
-        Z1 = np.zeros((1, 1))
-        O1 = np.ones((1, 1))
-        # Find farthest point
+        # NOTE One row of squared distances per selected vertex
         d = np.zeros((p, N))
-        index = np.zeros((p, 1))
-        V = np.zeros((1, N))
-        ZD = np.zeros((D, 1))
-        for i in range(N):
-            d[0, i] = self.Eucli_dist(x[:, i].reshape(D, 1), ZD)
-
-        index = np.argmax(d[0, :])
-
-        for i in range(N):
-            d[0, i] = self.Eucli_dist(x[:, i].reshape(D, 1), x[:, index].reshape(D, 1))
+        # Find farthest point
+        index = [np.argmax(self.sq_distances(x, np.zeros(D)))]
+        d[0] = self.sq_distances(x, x[:, index[0]])
 
         for v in range(1, p):
-            D1 = np.concatenate(
-                (d[0:v, index].reshape((v, index.size)), np.ones((v, 1))), axis=1
-            )
-            D2 = np.concatenate((np.ones((1, v)), Z1), axis=1)
-            D4 = np.concatenate((D1, D2), axis=0)
+            D4 = np.ones((v + 1, v + 1))
+            D4[:v, :v] = d[:v, index]
+            D4[v, v] = 0
             D4 = np.linalg.inv(D4)
 
-            for i in range(N):
-                D3 = np.concatenate((d[0:v, i].reshape((v, 1)), O1), axis=0)
-                V[0, i] = np.dot(np.dot(D3.T, D4), D3)
+            index.append(np.argmax(self.volumes(d[:v], D4)))
+            d[v] = self.sq_distances(x, x[:, index[v]])
 
-            index = np.append(index, np.argmax(V))
-            for i in range(N):
-                d[v, i] = self.Eucli_dist(
-                    x[:, i].reshape(D, 1), x[:, index[v]].reshape(D, 1)
-                )
-
-        per = np.argsort(index)
         index = np.sort(index)
-        d = d[per, :]
         E = x[:, index]
         logger.debug(f"Indices chosen: {index}")
         return E
@@ -244,22 +331,42 @@ class SiVM(BaseExtractor):
 class SISAL(BaseExtractor):
     def __init__(
         self,
+        coreset=None,
+        tol_f=None,
+        active_margin=None,
     ):
-        super().__init__()
+        super().__init__(coreset)
+        # NOTE Defaults of the TOLF and ACTIVE_MARGIN options
+        self.tol_f = tol_f
+        self.active_margin = active_margin
 
     @staticmethod
-    def soft_neg(y, tau):
+    def soft_neg(y, tau, out=None):
         """
         z = soft_neg(y,tau);
 
         negative soft (proximal operator of the hinge function)
-        """
 
-        z = np.maximum(np.abs(y + tau / 2) - tau / 2, 0)
-        z = z / (z + tau / 2) * (y + tau / 2)
-        return z
-
-    def extract_endmembers(self, Y, p, seed=0, snr_input=0, *args, **kwargs):
+        With `out`, y is overwritten and z is written to `out`.
+        """
+        if out is None:
+            z = np.maximum(np.abs(y + tau / 2) - tau / 2, 0)
+            z = z / (z + tau / 2) * (y + tau / 2)
+            return z
+
+        y += tau / 2
+        np.abs(y, out=out)
+        out -= tau / 2
+        np.maximum(out, 0, out=out)
+        # z / (z + tau / 2) * y
+        y *= out
+        out += tau / 2
+        np.divide(y, out, out=out)
+        return out
+
+    def extract_endmembers(
+        self, Y, p, seed=0, snr_input=0, subspace=None, *args, **kwargs
+    ):
         """
         M,Up,my,sing_values = sisal(Y,p,**kwargs)
 
@@ -307,12 +414,21 @@ class SISAL(BaseExtractor):
                 data spans over the same range along any axis.
                 Default: True
 
-        tolf - Tolerance for the termination test (relative variation of f(Q))
-            Default: 1e-2
+        tolf - Tolerance for the termination test (relative variation of f(Q)).
+            The MM iterations stop early once it is reached.
+            Default: None (MM_ITERS iterations)
+
+        active_margin - Restrict each MM iteration to the pixels whose hinge
+            is active or near-active (smallest coordinate in Q*y below the
+            margin). Interior pixels are checked again at every MM iteration.
+            Default: None (all pixels)
 
         M0 - Initial M, dimension L x p.
             Defaults is given by the VCA algorithm.
 
+        subspace - `SubspaceEstimator` already fitted on Y
+            Default: fitted on Y
+
         verbose - {0,1,2,3}
                         0 - work silently
                         1 - display simplex volume
@@ -368,8 +484,19 @@ class SISAL(BaseExtractor):
         # test for number of required parametres
         # --------------------------------------------------------------
 
+        # NOTE Interior pixels are dropped from the AL iterations by the
+        # coreset prefilter, each kept pixel standing for N / n pixels
+        weight = 1.0
+        if self.coreset is not None:
+            if subspace is None:
+                subspace = SubspaceEstimator().fit(Y)
+            N = Y.shape[1]
+            Y = Y[:, pixel_purity_coreset(Y, p, self.coreset, seed, subspace)]
+            weight = N / Y.shape[1]
+
         # data set size
         L, N = Y.shape
+        dtype = Y.dtype
         if L < p:
             raise ValueError("Insufficient number of columns in y")
 
@@ -396,6 +523,9 @@ class SISAL(BaseExtractor):
         M = 0
         # tolerance for the termination test
         #tol_f = 1e-2
+        tol_f = self.tol_f
+        # margin of the near-active hinge pixels
+        active_margin = self.active_margin
 
         ##
         # --------------------------------------------------------------
@@ -433,8 +563,10 @@ class SISAL(BaseExtractor):
                 mu = kwargs[key]
             elif Ukey == "TAU":
                 tau = kwargs[key]
-        #    elif Ukey == "TOLF":
-        #        tol_f = kwargs[key]
+            elif Ukey == "TOLF":
+                tol_f = kwargs[key]
+            elif Ukey == "ACTIVE_MARGIN":
+                active_margin = kwargs[key]
             elif Ukey == "M0":
                 M = kwargs[key]
             elif Ukey == "VERBOSE":
@@ -446,6 +578,10 @@ class SISAL(BaseExtractor):
                 # raise ValueError("Unrecognized option: {}".format(key))
                 pass
 
+        # NOTE `tau` is kept at the user's value: only the AL penalty follows
+        # the weight of the data terms on the coreset
+        mu = weight * mu
+
         ##
         # --------------------------------------------------------------
         # set display mode
@@ -459,11 +595,12 @@ class SISAL(BaseExtractor):
         # --------------------------------------------------------------
         # identify the affine space that best represent the data set y
         # --------------------------------------------------------------
-        meanY = Y.mean(axis=1, keepdims=True)
+        if subspace is None:
+            subspace = SubspaceEstimator().fit(Y)
+        meanY = subspace.mean.astype(dtype)
         Y = Y - meanY
-        Up, D, _ = lin.svd((Y @ Y.T) / N)
-        Up = Up[:, : p - 1]
-        d = D[: p - 1]
+        Up = subspace.Ud(p - 1).astype(dtype)
+        d = subspace.singular_values()[: p - 1]
 
         # represent y in the subspace R^(p-1)
         Y = Up @ Up.T @ Y
@@ -535,21 +672,25 @@ class SISAL(BaseExtractor):
             p
         )  # NOTE better conditioning when solving linear system
 
-        AAT = np.kron(YYT, np.eye(p))  # size p^2xp^2
         B = np.kron(np.eye(p), np.ones((1, p)))  # size pxp^2
         # qm = np.sum(lin.inv(Y @ Y.T) @ Y, axis=1)
         qm = np.sum(lin.solve(YYT_cond, Y), axis=1)  # NOTE Faster than solving inverse
 
         H = lam_quad * np.eye(p**2)
-        F = H + mu * AAT  # equation (11) of [1]
-        IF = lin.inv(F)
 
-        # auxiliar constant matrices
-        G = (
-            IF @ B.T @ lin.inv(B @ IF @ B.T + lam_quad * np.eye(p))
-        )  # NOTE better conditioning when inverting
-        qm_aux = G.dot(qm)
-        G = IF - G @ B @ IF
+        def constants(YYT):
+            # NOTE F = H + mu * kron(YYT, I) = kron(lam_quad * I + mu * YYT, I)
+            # is inverted through its p x p factor
+            IF = np.kron(lin.inv(lam_quad * np.eye(p) + mu * YYT), np.eye(p))
+            # auxiliar constant matrices
+            G = (
+                IF @ B.T @ lin.inv(B @ IF @ B.T + lam_quad * np.eye(p))
+            )  # NOTE better conditioning when inverting
+            qm_aux = G.dot(qm)
+            G = IF - G @ B @ IF
+            return G, qm_aux
+
+        G, qm_aux = constants(YYT)
 
         ##
         # ---------------------------------------------------------------
@@ -557,15 +698,35 @@ class SISAL(BaseExtractor):
         # ----------------------------------------------------------------
 
         # initializations
-        Z = Q @ Y
-        Bk = 0 * Z
+        QY_all = Q @ Y
+        Z_all = QY_all.copy()
+        Bk_all = np.zeros_like(Z_all)
 
         def hinge(x):
             return np.maximum(-x, 0)
 
+        f_prev = None
+        converged = False
         # NOTE Matlab uses column-major mode ('F' for Fortran) for flattening
         for k in range(MMiters):
 
+            # Pixels entering the current quadratic-hinge subproblem
+            if active_margin is None:
+                support = None
+                Ys, QY, Z, Bk = Y, QY_all, Z_all, Bk_all
+            else:
+                if k > 0:
+                    np.matmul(Q, Y, out=QY_all)
+                support = np.flatnonzero(QY_all.min(axis=0) < active_margin)
+                Ys = Y[:, support]
+                QY, Z, Bk = QY_all[:, support], Z_all[:, support], Bk_all[:, support]
+                G, qm_aux = constants(Ys @ Ys.T)
+                logger.debug(f"MMiter = {k}, {support.size} active pixels")
+            # NOTE In-place buffers for the AL iterations
+            R = np.empty_like(QY)
+            # Q @ Y of the MM iterate for the line search
+            Q0Y = QY.copy()
+
             IQ = lin.inv(Q)
             g = -IQ.T
             g = g.flatten(order="F")
@@ -597,50 +758,54 @@ class SISAL(BaseExtractor):
                     )
                 )
 
-            if k == MMiters - 1:  # NOTE Fixed where this condition was never met
+            last = k == MMiters - 1 or converged
+            if last:  # NOTE Fixed where this condition was never met
                 AL_iters = 100
 
             # jj = 0
             while 1 > 0:
                 q = Q.flatten(order="F")
                 # initial function values (true and quadratic)
-                f0_val = -np.log(np.abs(lin.det(Q))) + tau * np.sum(hinge(Q @ Y))
+                # NOTE QY holds Q @ Y for the current Q
+                hinge_val = tau * np.sum(hinge(QY))
+                f0_val = -np.log(np.abs(lin.det(Q))) + hinge_val
                 f0_quad = (
                     (q - q0).T.dot(g)
                     + 0.5 * (q - q0).T.dot(H).dot(q - q0)
-                    + tau * np.sum(hinge(Q.dot(Y)))
+                    + hinge_val
                 )
                 for i in range(AL_iters - 1):
                     # -------------------------------------------
                     # solve quadratic problem with constraints
                     # -------------------------------------------
-                    dq_aux = Z + Bk  # matrix form
-                    dtz_b = dq_aux @ Y.T
+                    dq_aux = np.add(Z, Bk, out=R)  # matrix form
+                    dtz_b = dq_aux @ Ys.T
                     dtz_b = dtz_b.flatten(order="F")
                     b = baux + mu * dtz_b  # (11) of [1]
                     q = G.dot(b) + qm_aux  # (10) of [1]
                     # NOTE q was exploding => flatten order was wrong!
                     Q = np.reshape(q, (p, p), order="F")
+                    # NOTE Single product per step
+                    np.matmul(Q, Ys, out=QY)
 
                     # -------------------------------------------
                     # solve hinge
                     # -------------------------------------------
-                    Z = self.soft_neg(Q @ Y - Bk, tau / mu)
+                    self.soft_neg(np.subtract(QY, Bk, out=R), tau / mu, out=Z)
 
                     # -------------------------------------------
                     # update Bk
                     # -------------------------------------------
 
-                    Bk = Bk - (Q @ Y - Z)
+                    Bk -= np.subtract(QY, Z, out=R)
                     if verbose == 3 or verbose == 4:
-                        logger.debug(
-                            "||Q*Y-Z|| = {0:.4e}".format(lin.norm(Q.dot(Y) - Z))
-                        )
+                        logger.debug("||Q*Y-Z|| = {0:.4e}".format(lin.norm(R)))
 
+                hinge_val = tau * np.sum(hinge(QY))
                 f_quad = (
                     (q - q0).T.dot(g)
                     + 0.5 * (q - q0).T.dot(H).dot(q - q0)
-                    + tau * np.sum(hinge(Q @ Y))
+                    + hinge_val
                 )
                 if verbose == 3 or verbose == 4:
                     logger.debug(
@@ -649,7 +814,7 @@ class SISAL(BaseExtractor):
                         )
                     )
 
-                f_val = -np.log(np.abs(lin.det(Q))) + tau * np.sum(hinge(Q.dot(Y)))
+                f_val = -np.log(np.abs(lin.det(Q))) + hinge_val
 
                 if f0_quad >= f_quad:  # quadratic energy decreased
                     while f0_val < f_val:
@@ -662,12 +827,27 @@ class SISAL(BaseExtractor):
 
                         # do line search
                         Q = (Q + Q0) / 2
+                        # NOTE Q @ Y is linear in Q (no product)
+                        QY += Q0Y
+                        QY /= 2
                         f_val = (
-                            -np.log(np.abs(lin.det(Q))) + tau * hinge(Q @ Y).sum()
+                            -np.log(np.abs(lin.det(Q))) + tau * hinge(QY).sum()
                         )  # NOTE Fixed sum computation
 
                     break
 
+            if support is not None:
+                QY_all[:, support], Z_all[:, support], Bk_all[:, support] = QY, Z, Bk
+
+            if last:
+                break
+            # Termination test on the relative variation of f(Q)
+            if tol_f is not None and f_prev is not None:
+                converged = abs(f_val - f_prev) <= tol_f * abs(f_prev)
+                if converged:
+                    logger.debug(f"SISAL converged after {k + 1} MM iterations")
+            f_prev = f_val
+
         if spherize:
             M = lin.inv(Q)
             # refer to the initial affine set
@@ -683,7 +863,7 @@ class SISAL(BaseExtractor):
         else:
             M = Up.dot(lin.inv(Q))
 
-        return M
+        return M.astype(dtype, copy=False)
 
 
 class VCA_MATLAB(BaseExtractor):
@@ -713,7 +893,7 @@ class VCA_MATLAB(BaseExtractor):
             "snr",
             matlab.double([snr_input]),
         )
-        Ehat = np.array(Ehat).astype(np.float32)
+        Ehat = np.array(Ehat).astype(Y.dtype)
         tac = time.time()
         self.time = round(tac - tic, 2)
         logger.info(f"VCA MATLAB took {self.time} seconds")
@@ -753,7 +933,7 @@ class SISAL_MATLAB(BaseExtractor):
             matlab.int8([3]),
         )
 
-        Ehat = np.array(Ehat).astype(np.float32)
+        Ehat = np.array(Ehat).astype(Y.dtype)
         tac = time.time()
         self.time = round(tac - tic, 2)
         logger.info(f"SISAL MATLAB took {self.time} seconds")
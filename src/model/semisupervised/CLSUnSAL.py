@@ -17,6 +17,9 @@ logger.setLevel(logging.DEBUG)
 
 
 class CLSUnSAL(SparseUnmixingModel):
+    weighted = True
+    least_squares = True
+
     def __init__(
         self,
         AL_iters=1000,
@@ -66,10 +69,12 @@ class CLSUnSAL(SparseUnmixingModel):
         mu = self.mu
         logger.debug(f"Mu initial value => {mu:.3e}")
 
-        UF, sF, VF = LA.svd(D.T @ D)
-        IF = UF @ (np.diag(1 / (sF + mu))) @ UF.T
+        # NOTE Operators computed in float64 and cast to the working precision
+        G = D.astype(np.float64).T @ D.astype(np.float64)
+        UF, sF, VF = LA.svd(G)
+        IF = (UF @ (np.diag(1 / (sF + mu))) @ UF.T).astype(Y.dtype)
 
-        AA = LA.inv(D.T @ D + 2 * np.eye(M))
+        AA = LA.inv(G + 2 * np.eye(M)).astype(Y.dtype)
 
         # Initializations
         if self.x0 == 0:
@@ -59,7 +59,7 @@ class MUA_SLIC(SparseUnmixingModel):
         logger.debug(f"{n_superpixels} superpixels used in SLIC")
 
         # Average all pixels inside each superpixel
-        avg_superpixel = np.zeros((n_superpixels, L))
+        avg_superpixel = np.zeros((n_superpixels, L), dtype=Y.dtype)
         for ii in range(n_superpixels):
             indices = np.argwhere(labels == ii)
             rowi = indices[:, 0]
@@ -87,7 +87,7 @@ class MUA_SLIC(SparseUnmixingModel):
         logger.info(f"X shape => {X.shape}")
 
         # Reattribute abundances for the entire matrix
-        A0 = np.zeros((H, W, M))
+        A0 = np.zeros((H, W, M), dtype=Y.dtype)
         for label in range(n_superpixels):
             A0[labels == label] = X[:, label]
 
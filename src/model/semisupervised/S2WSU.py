@@ -18,6 +18,7 @@ logger.setLevel(logging.DEBUG)
 
 
 class S2WSU(SparseUnmixingModel):
+    least_squares = True
     def __init__(
         self,
         AL_iters=5,
@@ -64,10 +65,12 @@ class S2WSU(SparseUnmixingModel):
         mu = 0.5
         logger.debug(f"Mu initial value => {mu:.3e}")
 
-        UF, sF, VF = LA.svd(D.T @ D)
-        IF = UF @ (np.diag(1 / (sF + mu))) @ UF.T
+        # NOTE Operators computed in float64 and cast to the working precision
+        G = D.astype(np.float64).T @ D.astype(np.float64)
+        UF, sF, VF = LA.svd(G)
+        IF = (UF @ (np.diag(1 / (sF + mu))) @ UF.T).astype(Y.dtype)
 
-        AA = LA.inv(D.T @ D + 2 * np.eye(M))
+        AA = LA.inv(G + 2 * np.eye(M)).astype(Y.dtype)
 
         # Initializations
         if self.x0 == 0:
@@ -93,7 +96,7 @@ class S2WSU(SparseUnmixingModel):
         # res_d = float("inf")
         AL_iters2 = 60
 
-        kernel = np.ones((3, 3))
+        kernel = np.ones((3, 3), dtype=Y.dtype)
         kernel[1, 1] = 0
         kernel[0, 0] = 1 / np.sqrt(2)
         kernel[2, 0] = 1 / np.sqrt(2)
@@ -103,7 +106,7 @@ class S2WSU(SparseUnmixingModel):
 
         while k <= AL_iters2:
 
-            NU = np.zeros((M, N))
+            NU = np.zeros((M, N), dtype=Y.dtype)
             X2 = np.reshape(v3 - d3, (M, H, W))
             for ii in range(M):
                 NU[ii] = convolve2d(X2[ii], kernel, mode="same").flatten()
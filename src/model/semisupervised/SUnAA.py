@@ -54,8 +54,8 @@ class SUnAA(SparseUnmixingModel):
 
         YY = np.asfortranarray(Y)
         DD = np.asfortranarray(D)
-        B = (1 / N_atoms) * np.ones((N_atoms, self.p))
-        A = (1 / self.p) * np.ones((self.p, N))
+        B = (1 / N_atoms) * np.ones((N_atoms, self.p), dtype=Y.dtype)
+        A = (1 / self.p) * np.ones((self.p, N), dtype=Y.dtype)
 
         logger.info(f"Initial loss => {loss(A, B):.2f}")
 
@@ -16,6 +16,21 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+def AL_operators(UF, sF, dtype):
+    """
+    Inverse operators of the x-update given the eigendecomposition (UF, sF)
+    of the regularized Gram matrix
+
+    NOTE Computed in float64 and cast to the working precision.
+    The sum-to-one offset x_aux (M x 1) is broadcast over the pixels.
+    """
+    IF = UF @ np.diag(1 / sF) @ UF.T
+    B = np.ones((1, UF.shape[0]))
+    Aux = IF @ B.T @ LA.inv(B @ IF @ B.T)
+    IF1 = IF - Aux @ B @ IF
+    return IF.astype(dtype), IF1.astype(dtype), Aux.astype(dtype)
+
+
 class SUnSAL_SpReg(SparseUnmixingModel):
     def __init__(
         self,
@@ -50,8 +65,10 @@ class SUnSAL_SpReg(SparseUnmixingModel):
         assert MX == M, "Inconsistent number of atoms for D and X"
         assert N == NX, "Inconsistent number of pixels for X and Y"
 
+        dtype = Y.dtype
+
         # Lambda for all pixels
-        lambd = self.lambd * np.ones((M, N))
+        lambd = self.lambd * np.ones((M, N), dtype=dtype)
 
         # Compute mean norm
         norm_y = np.sqrt(np.mean(Y**2))
@@ -74,8 +91,8 @@ class SUnSAL_SpReg(SparseUnmixingModel):
 
         # Constrained Least Squares (sum(x) = 1)
         SMALL = 1e-12
-        B = np.ones((1, M))
-        a = np.ones((1, N))
+        B = np.ones((1, M), dtype=dtype)
+        a = np.ones((1, N), dtype=dtype)
 
         if (
             np.sum(lambd == 0)
@@ -100,13 +117,11 @@ class SUnSAL_SpReg(SparseUnmixingModel):
 
         logger.debug(f"mu initial value: {mu:.3e}")
 
-        UF, sF, VF = LA.svd(D.T @ D)
+        # NOTE Gram matrix accumulated in float64
+        D64 = D.astype(np.float64)
+        UF, sF, VF = LA.svd(D64.T @ D64)
         #SF = np.diag(sF)
-        IF = UF @ (np.diag(1 / (sF + mu + self.beta))) @ UF.T
-
-        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-        x_aux = Aux @ a
-        IF1 = IF - Aux @ B @ IF
+        IF, IF1, x_aux = AL_operators(UF, sF + mu + self.beta, dtype)
         yy = D.T @ Y
 
         # Initializations
@@ -171,10 +186,7 @@ class SUnSAL_SpReg(SparseUnmixingModel):
                     if mu_changed:
                         logger.debug(f"mu changed ({i}) => {mu}")
                         # Update IF and IF1
-                        IF = UF @ np.diag(1 / (sF + mu + self.beta)) @ UF.T
-                        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-                        x_aux = Aux @ a
-                        IF1 = IF - Aux @ B @ IF
+                        IF, IF1, x_aux = AL_operators(UF, sF + mu + self.beta, dtype)
                         mu_changed = 0
 
                 i += 1
@@ -220,10 +232,7 @@ class SUnSAL_SpReg(SparseUnmixingModel):
 
                     if mu_changed:
                         # Update IF and IF1
-                        IF = UF @ np.diag(1 / (sF + mu)) @ UF.T
-                        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-                        x_aux = Aux @ a
-                        IF1 = IF - Aux @ B @ IF
+                        IF, IF1, x_aux = AL_operators(UF, sF + mu, dtype)
                         mu_changed = 0
 
                 i += 1
@@ -280,10 +289,7 @@ class SUnSAL_SpReg(SparseUnmixingModel):
                     if mu_changed:
                         # Update IF and IF1
                         logger.debug(f"mu changed ({i}) => {mu}")
-                        IF = UF @ np.diag(1 / (sF + mu + self.beta)) @ UF.T
-                        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-                        x_aux = Aux @ a
-                        IF1 = IF - Aux @ B @ IF
+                        IF, IF1, x_aux = AL_operators(UF, sF + mu + self.beta, dtype)
                         mu_changed = 0
 
                 i += 1
@@ -296,6 +302,9 @@ class SUnSAL_SpReg(SparseUnmixingModel):
 
 
 class SUnSAL(SparseUnmixingModel):
+    pixelwise = True
+    least_squares = True
+
     def __init__(
         self,
         AL_iters=1000,
@@ -325,8 +334,10 @@ class SUnSAL(SparseUnmixingModel):
 
         assert L == LD, "Inconsistent number of channels for D and Y"
 
+        dtype = Y.dtype
+
         # Lambda for all pixels
-        lambd = self.lambd * np.ones((M, N))
+        lambd = self.lambd * np.ones((M, N), dtype=dtype)
 
         # Compute mean norm
         # NOTE This typo led to better results
@@ -349,8 +360,8 @@ class SUnSAL(SparseUnmixingModel):
 
         # Constrained Least Squares (sum(x) = 1)
         SMALL = 1e-12
-        B = np.ones((1, M))
-        a = np.ones((1, N))
+        B = np.ones((1, M), dtype=dtype)
+        a = np.ones((1, N), dtype=dtype)
 
         if np.sum(lambd == 0) and self.addone and not self.positivity:
             logger.debug("Constrained Least Squares (sum(x) = 1)")
@@ -370,13 +381,11 @@ class SUnSAL(SparseUnmixingModel):
         # mu = mu_AL
         logger.debug(f"mu initial value: {mu:.3e}")
 
-        UF, sF, VF = LA.svd(D.T @ D)
+        # NOTE Gram matrix accumulated in float64
+        D64 = D.astype(np.float64)
+        UF, sF, VF = LA.svd(D64.T @ D64)
         #SF = np.diag(sF)
-        IF = UF @ (np.diag(1 / (sF + mu))) @ UF.T
-
-        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-        x_aux = Aux @ a
-        IF1 = IF - Aux @ B @ IF
+        IF, IF1, x_aux = AL_operators(UF, sF + mu, dtype)
         yy = D.T @ Y
 
         # Initializations
@@ -441,10 +450,7 @@ class SUnSAL(SparseUnmixingModel):
                     if mu_changed:
                         logger.debug(f"mu changed ({i}) => {mu}")
                         # Update IF and IF1
-                        IF = UF @ np.diag(1 / (sF + mu)) @ UF.T
-                        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-                        x_aux = Aux @ a
-                        IF1 = IF - Aux @ B @ IF
+                        IF, IF1, x_aux = AL_operators(UF, sF + mu, dtype)
                         mu_changed = 0
 
                 i += 1
@@ -490,10 +496,7 @@ class SUnSAL(SparseUnmixingModel):
 
                     if mu_changed:
                         # Update IF and IF1
-                        IF = UF @ np.diag(1 / (sF + mu)) @ UF.T
-                        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-                        x_aux = Aux @ a
-                        IF1 = IF - Aux @ B @ IF
+                        IF, IF1, x_aux = AL_operators(UF, sF + mu, dtype)
                         mu_changed = 0
 
                 i += 1
@@ -550,10 +553,7 @@ class SUnSAL(SparseUnmixingModel):
                     if mu_changed:
                         # Update IF and IF1
                         logger.debug(f"mu changed ({i}) => {mu}")
-                        IF = UF @ np.diag(1 / (sF + mu)) @ UF.T
-                        Aux = IF @ B.T @ (LA.inv(B @ IF @ B.T))
-                        x_aux = Aux @ a
-                        IF1 = IF - Aux @ B @ IF
+                        IF, IF1, x_aux = AL_operators(UF, sF + mu, dtype)
                         mu_changed = 0
 
                 i += 1
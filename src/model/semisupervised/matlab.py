@@ -25,6 +25,9 @@ class SUnSAL_MATLAB(SparseUnmixingModel):
     https://github.com/ricardoborsoi/MUA_SparseUnmixing
     """
 
+    pixelwise = True
+    least_squares = True
+
     def __init__(
         self,
         root_matlab,
@@ -69,7 +72,7 @@ class SUnSAL_MATLAB(SparseUnmixingModel):
             nargout=1,
         )
 
-        Ahat = np.array(Ahat).astype(np.float32)
+        Ahat = np.array(Ahat).astype(Y.dtype)
 
         tac = time.time()
         self.time = round(tac - tic, 2)
@@ -139,7 +142,7 @@ class SUnSALTV(SparseUnmixingModel):
             nargout=1,
         )
 
-        Ahat = np.array(Ahat).astype(np.float32)
+        Ahat = np.array(Ahat).astype(Y.dtype)
 
         tac = time.time()
         self.time = round(tac - tic, 2)
@@ -201,7 +204,7 @@ class S2WSU_MATLAB(SparseUnmixingModel):
             nargout=1,
         )
 
-        Ahat = np.array(Ahat).astype(np.float32)
+        Ahat = np.array(Ahat).astype(Y.dtype)
 
         tac = time.time()
         self.time = round(tac - tic, 2)
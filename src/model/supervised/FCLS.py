@@ -15,8 +15,35 @@ logger.setLevel(logging.DEBUG)
 
 
 class FCLS(SupervisedUnmixingModel):
-    def __init__(self, *args, **kwargs):
-        super().__init__()
+    pixelwise = True
+    least_squares = True
+
+    ENGINES = ("active_set", "cvxopt")
+
+    def __init__(
+        self,
+        engine="active_set",
+        closed_form=True,
+        tol=1e-10,
+        max_iter=None,
+        n_jobs=1,
+        chunk_size=2**14,
+        backend="process",
+        *args,
+        **kwargs,
+    ):
+        super().__init__(n_jobs, chunk_size, backend)
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown FCLS engine {engine} (valid: {self.ENGINES})")
+        # NOTE cvxopt solves one QP per pixel (reference/validation engine)
+        self.engine = engine
+        # Only pixels with a negative closed-form SCLS solution go to the engine
+        self.closed_form = closed_form
+        self.tol = tol
+        self.max_iter = max_iter
+        # Number of pixels solved in closed form / by the engine
+        self.n_closed_form = 0
+        self.n_constrained = 0
 
     @staticmethod
     def _numpy_None_vstack(A1, A2):
@@ -75,14 +102,193 @@ class FCLS(SupervisedUnmixingModel):
 
         assert L1 == L2
 
+        # NOTE Endmembers and constant operators are shared by all blocks
+        E64 = E.astype(np.float64)
+        shared = {"E": E64, "G": E64.T @ E64}
+        if self.closed_form:
+            W, b = self._scls_operator(E64)
+            shared.update(W=W.astype(Y.dtype), b=b.astype(Y.dtype))
+        X, counts = self.executor.run(self._solve_chunk, Y, p, **shared)
+
+        self.n_constrained = int(sum(counts))
+        self.n_closed_form = N - self.n_constrained
+        logger.info(
+            f"{self.n_closed_form} pixels solved in closed form, "
+            f"{self.n_constrained} by the {self.engine} engine"
+        )
+
+        # Record time
+        self.time = time.time() - tic
+        logger.info(self.print_time())
+
+        return X
+
+    @staticmethod
+    def _scls_operator(E):
+        """
+        Closed-form sum-to-one constrained least squares a = W y + b
+
+        W = (I - u 1^T / s) G^-1 E^T and b = u / s,
+        where G = E^T E, u = G^-1 1 and s = 1^T G^-1 1.
+        """
+        IG = np.linalg.pinv(E.T @ E)
+        u = IG.sum(axis=1)
+        s = u.sum()
+        W = IG @ E.T
+        W -= np.outer(u, W.sum(axis=0)) / s
+        return W, u / s
+
+    def _solve_chunk(self, Y, out, E, G, W=None, b=None):
+        """
+        Abundances of a block of pixels written to `out`
+
+        Returns the number of pixels solved by the engine.
+        """
+        if W is None:
+            out[:] = self._engine(Y, E, G)
+            return Y.shape[1]
+
+        out[:] = W @ Y + b[:, np.newaxis]
+        todo = np.flatnonzero(np.any(out < 0, axis=0))
+        if todo.size > 0:
+            out[:, todo] = self._engine(Y[:, todo], E, G)
+        return todo.size
+
+    def _engine(self, Y, E, G):
+        if self.engine == "active_set":
+            return self._active_set(Y, E, G)
+        return self._cvxopt(Y, E)
+
+    @staticmethod
+    def _passive_solve(G, C, P, min_group=32, batch_size=2**14):
+        """
+        Sum-to-one constrained least squares restricted to the passive sets
+
+        G: Gram matrix (p x p), C: correlations E^T Y (p x n), P: passive
+        sets (p x n). Pixels sharing a passive set are solved at once, the
+        pixels of smaller groups as a stack of masked (p + 1) systems.
+        Returns the solutions (p x n), zero outside the passive sets, and the
+        Lagrange multipliers of the sum-to-one constraint (n).
+        """
+        p, n = C.shape
+        Z = np.zeros((p, n))
+        lam = np.zeros(n)
+        # NOTE Passive sets are grouped by bitmask
+        if p < 64:
+            bits = np.left_shift(1, np.arange(p, dtype=np.uint64), dtype=np.uint64)
+            codes = bits @ P.astype(np.uint64)
+            _, first, groups = np.unique(codes, return_index=True, return_inverse=True)
+            sets = P[:, first].T
+        else:
+            sets, groups = np.unique(P.T, axis=0, return_inverse=True)
+        groups = groups.ravel()
+        counts = np.bincount(groups, minlength=len(sets))
+        order = np.argsort(groups, kind="stable")
+        for g, cols in enumerate(np.split(order, np.cumsum(counts)[:-1])):
+            if counts[g] < min_group:
+                continue
+            idx = np.flatnonzero(sets[g])
+            k = idx.size
+            # KKT system [G_PP 1; 1^T 0] [a_P; lambda] = [c_P; 1]
+            K = np.ones((k + 1, k + 1))
+            K[:k, :k] = G[np.ix_(idx, idx)]
+            K[k, k] = 0
+            rhs = np.ones((k + 1, cols.size))
+            rhs[:k] = C[np.ix_(idx, cols)]
+            sol = np.linalg.lstsq(K, rhs, rcond=None)[0]
+            Z[np.ix_(idx, cols)] = sol[:k]
+            lam[cols] = sol[k]
+
+        # NOTE Active variables are pinned to 0 by identity rows and columns
+        K = np.ones((p + 1, p + 1))
+        K[:p, :p] = G
+        K[p, p] = 0
+        for start in range(0, n, batch_size):
+            cols = np.arange(start, min(start + batch_size, n))
+            cols = cols[counts[groups[cols]] < min_group]
+            if cols.size == 0:
+                continue
+            mask = np.ones((cols.size, p + 1), dtype=bool)
+            mask[:, :p] = P[:, cols].T
+            Ks = np.where(mask[:, :, np.newaxis] & mask[:, np.newaxis, :], K, 0)
+            Ks[:, np.arange(p), np.arange(p)] += ~mask[:, :p]
+            rhs = np.ones((cols.size, p + 1))
+            rhs[:, :p] = np.where(mask[:, :p], C[:, cols].T, 0)
+            try:
+                sol = np.linalg.solve(Ks, rhs[:, :, np.newaxis])[:, :, 0]
+            except np.linalg.LinAlgError:
+                sol = (np.linalg.pinv(Ks) @ rhs[:, :, np.newaxis])[:, :, 0]
+            Z[:, cols] = sol[:, :p].T
+            lam[cols] = sol[:, p]
+        return Z, lam
+
+    def _active_set(self, Y, E, G):
+        """
+        Batched active set method (Lawson-Hanson with the sum-to-one constraint)
+
+        Every step is run on all the pixels not yet converged, with one linear
+        solve per distinct passive set (see `_passive_solve`).
+        """
+        L, N = Y.shape
+        p = E.shape[1]
+        tol = self.tol
+        max_iter = 3 * p if self.max_iter is None else self.max_iter
+
+        C = E.T @ Y
+
+        # Feasible start on the closest endmember (||e_j||^2 - 2 c_j)
+        start = np.argmin(np.diag(G)[:, np.newaxis] - 2 * C, axis=0)
+        A = np.zeros((p, N))
+        A[start, np.arange(N)] = 1
+        P = A > 0
+
+        active = np.arange(N)
+        for it in range(max_iter):
+            # Dual variables of the nonnegativity constraints
+            Ga = G @ A[:, active] - C[:, active]
+            lam = -np.sum(Ga * P[:, active], axis=0) / P[:, active].sum(axis=0)
+            mu = np.where(P[:, active], np.inf, Ga + lam)
+            entering = np.argmin(mu, axis=0)
+            optimal = mu[entering, np.arange(active.size)] >= -tol
+            active, entering = active[~optimal], entering[~optimal]
+            if active.size == 0:
+                break
+            P[entering, active] = True
+
+            # Inner loop: move back to the feasible set
+            cols = active
+            while cols.size > 0:
+                Z, _ = self._passive_solve(G, C[:, cols], P[:, cols])
+                Pc, Ac = P[:, cols], A[:, cols]
+                infeasible = np.any(Pc & (Z <= tol), axis=0)
+                A[:, cols[~infeasible]] = Z[:, ~infeasible]
+                cols = cols[infeasible]
+                if cols.size == 0:
+                    break
+                Pc, Ac, Z = Pc[:, infeasible], Ac[:, infeasible], Z[:, infeasible]
+                blocking = Pc & (Z <= tol)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    ratios = np.where(blocking, Ac / (Ac - Z), np.inf)
+                alpha = np.min(ratios, axis=0)
+                Ac = Ac + alpha * (Z - Ac)
+                Pc = Pc & (Ac > tol)
+                Ac[~Pc] = 0
+                A[:, cols], P[:, cols] = Ac, Pc
+        else:
+            logger.warning(f"FCLS: {active.size} pixels did not converge")
+
+        return A.astype(Y.dtype)
+
+    def _cvxopt(self, Y, E):
+        L1, N = Y.shape
+        L2, p = E.shape
+
         # Reshape to match implementation
-        M = np.copy(Y.T)
-        U = np.copy(E.T)
+        # NOTE cvxopt only handles double precision, pixels are cast one by one
+        U = E.T.astype(np.double)
 
         solvers.options["show_progress"] = False
 
-        U = U.astype(np.double)
-
         C = self._numpy_to_cvxopt_matrix(U.T)
         Q = C.T * C
 
@@ -96,32 +302,61 @@ class FCLS(SupervisedUnmixingModel):
         Aeq = self._numpy_to_cvxopt_matrix(np.ones((1, p)))
         beq = self._numpy_to_cvxopt_matrix(np.ones(1))
 
-        M = np.array(M, dtype=np.float64)
-        M = M.astype(np.double)
-        X = np.zeros((N, p), dtype=np.float32)
+        X = np.zeros((N, p), dtype=Y.dtype)
         for n1 in range(N):
-            d = matrix(M[n1], (L1, 1), "d")
+            d = matrix(Y[:, n1].astype(np.double), (L1, 1), "d")
             q = -d.T * C
             sol = solvers.qp(Q, q.T, A, b, Aeq, beq, None, None)["x"]
             X[n1] = np.array(sol).squeeze()
 
-        # Record time
-        self.time = time.time() - tic
-        logger.info(self.print_time())
-
         return X.T
 
 
 class DecompSimplex(SupervisedUnmixingModel):
-    def __init__(self, *args, **kwargs):
-        super().__init__()
+    pixelwise = True
+    least_squares = True
+
+    def __init__(
+        self,
+        numThreads=-1,
+        memmap=None,
+        n_jobs=1,
+        chunk_size=2**14,
+        backend="process",
+        *args,
+        **kwargs,
+    ):
+        super().__init__(n_jobs, chunk_size, backend)
+        # NOTE spams threads per block (-1: all cores)
+        self.numThreads = numThreads
+        # Optional `.npy` file memory-mapped to hold the abundances
+        self.memmap = memmap
+
+    def _solve_chunk(self, Y, out, E):
+        YY = np.asfortranarray(Y)
+        alpha = spams.decompSimplex(
+            YY,
+            np.asfortranarray(E),
+            numThreads=self.numThreads,
+        ).tocoo()
+        # NOTE Sparse codes are scattered into the output (no dense copy)
+        out[...] = 0
+        out[alpha.row, alpha.col] = alpha.data
 
     def compute_abundances(self, Y, E, *args, **kwargs):
         tic = time.time()
 
-        YY = np.asfortranarray(Y)
-        EE = np.asfortranarray(E)
-        A = np.array(spams.decompSimplex(YY, EE).todense())
+        L, N = Y.shape
+        p = E.shape[1]
+        out = None
+        if self.memmap is not None:
+            out = np.lib.format.open_memmap(
+                self.memmap, mode="w+", dtype=Y.dtype, shape=(p, N)
+            )
+
+        # NOTE spams requires both matrices to share the same precision
+        EE = np.asfortranarray(E, dtype=Y.dtype)
+        A, _ = self.executor.run(self._solve_chunk, Y, p, out=out, E=EE)
 
         self.time = time.time() - tic
         logger.info(self.print_time())
@@ -11,6 +11,7 @@ import torch.nn as nn
 import torch
 import torch.nn.functional as F
 
+from src.model.base import ConvergenceMonitor
 from .base import SupervisedUnmixingModel
 
 logger = logging.getLogger(__name__)
@@ -25,6 +26,12 @@ class UnDIP(nn.Module, SupervisedUnmixingModel):
         exp_weight=0.99,
         noisy_input=True,
         kernel_size=3,
+        early_stopping=False,
+        tol=1e-3,
+        loss_tol=1e-3,
+        window=100,
+        patience=3,
+        min_iters=1000,
     ):
         super().__init__()
 
@@ -46,6 +53,16 @@ class UnDIP(nn.Module, SupervisedUnmixingModel):
         self.lr = lr
         self.exp_weight = exp_weight
         self.noisy_input = noisy_input
+        # Stop before `niters` once `out_avg` and the loss are stable
+        self.monitor = None
+        if early_stopping:
+            self.monitor = ConvergenceMonitor(
+                tol=tol,
+                loss_tol=loss_tol,
+                window=window,
+                patience=patience,
+                min_iters=min_iters,
+            )
 
     def init_architecture(
         self,
@@ -153,7 +170,7 @@ class UnDIP(nn.Module, SupervisedUnmixingModel):
 
         num_channels, h, w = self.L, self.H, self.W
 
-        Y = torch.Tensor(Y)
+        Y = torch.as_tensor(Y, dtype=torch.float32).contiguous()
         Y = Y.view(1, num_channels, h, w)
 
         self = self.to(self.device)
@@ -164,6 +181,9 @@ class UnDIP(nn.Module, SupervisedUnmixingModel):
 
         noisy_input = torch.rand_like(Y) if self.noisy_input else Y
 
+        if self.monitor is not None:
+            self.monitor.reset()
+
         progress = tqdm(range(self.niters))
         for ii in progress:
             optimizer.zero_grad()
@@ -180,11 +200,18 @@ class UnDIP(nn.Module, SupervisedUnmixingModel):
             # Reshape data
             loss = F.mse_loss(Y.view(-1, h * w), E @ abund.view(-1, h * w))
 
-            progress.set_postfix_str(f"loss={loss.item():.3e}")
+            loss_value = loss.item()
+            progress.set_postfix_str(f"loss={loss_value:.3e}")
 
             loss.backward()
             optimizer.step()
 
+            if self.monitor is not None and self.monitor.update(
+                ii, loss_value, out_avg
+            ):
+                progress.close()
+                break
+
         A = out_avg.cpu().numpy().reshape(-1, h * w)
         self.time = time.time() - tic
         logger.info(self.print_time())
@@ -1,15 +1,179 @@
 """
 Base model declaration for supervised unmixing methods
 """
+import ctypes
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import sharedctypes
+
+import numpy as np
 
 from src.model.base import UnmixingModel
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def shared_array(shape, dtype):
+    """
+    Empty array on shared memory, that worker processes attach without copy
+    """
+    dtype = np.dtype(dtype)
+    nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+    raw = sharedctypes.RawArray(ctypes.c_byte, nbytes)
+    return np.ndarray(shape, dtype=dtype, buffer=raw)
+
+
+def _shared_buffer(X):
+    """
+    Shared memory buffer holding X (None when X lives in private memory)
+    """
+    base = X
+    while base is not None and not isinstance(base, ctypes.Array):
+        base = base.base if isinstance(base, np.ndarray) else getattr(base, "obj", None)
+    return base
+
+
+def _to_shared(X):
+    """
+    Location of an array for the workers, copied to shared memory if needed
+
+    Arrays built on shared memory (`shared_array`) are passed as is and
+    memory-mapped arrays are reopened from their file.
+    """
+    if isinstance(X, np.memmap) and X.filename is not None and X.flags.c_contiguous:
+        offset = X.offset + _memmap_start(X)
+        mode = "r+" if X.flags.writeable else "r"
+        return ("memmap", X.filename, X.shape, X.dtype.str, (offset, mode))
+    raw = _shared_buffer(X)
+    if raw is None or not X.flags.c_contiguous:
+        X_shared = shared_array(X.shape, X.dtype)
+        X_shared[...] = X
+        X, raw = X_shared, _shared_buffer(X_shared)
+    offset = X.__array_interface__["data"][0] - ctypes.addressof(raw)
+    return ("raw", raw, X.shape, X.dtype.str, offset)
+
+
+def _memmap_start(X):
+    """
+    Byte offset of a memmap view in its mapped buffer
+    """
+    base = X
+    while isinstance(base.base, np.memmap):
+        base = base.base
+    return X.__array_interface__["data"][0] - base.__array_interface__["data"][0]
+
+
+def _from_shared(spec):
+    kind, source, shape, dtype, location = spec
+    if kind == "memmap":
+        offset, mode = location
+        return np.memmap(source, dtype=dtype, mode=mode, shape=shape, offset=offset)
+    return np.ndarray(shape, dtype=dtype, buffer=source, offset=location)
+
+
+# NOTE Arrays attached once per worker process
+_worker = {}
+
+
+def _init_worker(fn, specs):
+    arrays = {key: _from_shared(spec) for key, spec in specs.items()}
+    _worker.update(fn=fn, arrays=arrays)
+
+
+def _run_chunk(start, stop):
+    arrays = dict(_worker["arrays"])
+    Y, out = arrays.pop("Y"), arrays.pop("out")
+    return _worker["fn"](Y[:, start:stop], out[:, start:stop], **arrays)
+
+
+class PixelChunkExecutor:
+    """
+    Run a pixel-wise solver on blocks of pixels in a process or thread pool
+
+    `fn(Y_chunk, out_chunk, **shared)` writes the abundances of a block of
+    pixels into `out_chunk` and may return a small value (e.g. a count).
+    With processes, the abundances are built on shared memory and written in
+    place by the workers. Y and the `shared` arrays (endmembers, Gram
+    matrix...) are attached from shared memory (copied there once unless
+    built with `shared_array` or memory-mapped), so that only pixel ranges
+    are sent to the workers.
+
+    Blocks only depend on `chunk_size`, so that results do not depend on
+    the number of workers.
+    """
+
+    BACKENDS = ("process", "thread")
+
+    def __init__(self, n_jobs=1, chunk_size=2**14, backend="process"):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend} (valid: {self.BACKENDS})")
+        self.n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+        self.chunk_size = chunk_size
+        self.backend = backend
+
+    def run(self, fn, Y, p, dtype=None, out=None, **shared):
+        """
+        Abundances (p x N) of Y (L x N), and the list of `fn` returns per block
+
+        The abundances are written to `out` when given (e.g. a memmap).
+        """
+        N = Y.shape[1]
+        dtype = Y.dtype if dtype is None else dtype
+        if out is not None:
+            assert out.shape == (p, N), f"Invalid output shape {out.shape}"
+        bounds = [
+            (start, min(start + self.chunk_size, N))
+            for start in range(0, N, self.chunk_size)
+        ]
+        n_jobs = min(self.n_jobs, len(bounds))
+        logger.debug(f"{len(bounds)} blocks of pixels on {n_jobs} {self.backend}(es)")
+
+        if n_jobs <= 1 or self.backend == "thread":
+            A = np.empty((p, N), dtype=dtype) if out is None else out
+
+            def run_chunk(bound):
+                start, stop = bound
+                return fn(Y[:, start:stop], A[:, start:stop], **shared)
+
+            if n_jobs <= 1:
+                return A, [run_chunk(bound) for bound in bounds]
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                return A, list(executor.map(run_chunk, bounds))
+
+        # NOTE Blocks are written in place in A (built on shared memory)
+        A = shared_array((p, N), dtype) if out is None else out
+        specs = {
+            key: _to_shared(X if isinstance(X, np.memmap) else np.asarray(X))
+            for key, X in dict(shared, Y=Y).items()
+        }
+        specs["out"] = _to_shared(A)
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_worker,
+            initargs=(fn, specs),
+        ) as executor:
+            starts, stops = zip(*bounds)
+            results = list(executor.map(_run_chunk, starts, stops))
+        if specs["out"][0] == "memmap":
+            A.flush()
+        elif _shared_buffer(A) is None or not A.flags.c_contiguous:
+            # Output in private memory (given by the caller)
+            A[...] = _from_shared(specs["out"])
+        return A, results
+
 
 class SupervisedUnmixingModel(UnmixingModel):
     def __init__(
         self,
+        n_jobs=1,
+        chunk_size=2**14,
+        backend="process",
     ):
         super().__init__()
+        # Pixel blocks dispatch of pixel-wise solvers
+        self.executor = PixelChunkExecutor(n_jobs, chunk_size, backend)
 
     def compute_abundances(
         self,
@@ -5,8 +5,15 @@ import mlxp
 from mlxp.launcher import _instance_from_config
 import logging
 import numpy as np
+import scipy.sparse as sp
 
-from src.data.utils import SVD_projection
+from src.data.utils import (
+    preprocess_sweep,
+    tiled_abundances,
+    deduplicated_abundances,
+    sparsify,
+    subspace_reduce,
+)
 from src.utils.metrics import SRE, aRMSE, compute_metric
 from src.utils.aligners import AbundancesAligner
 from src.data.base import Estimate
@@ -14,37 +21,58 @@ from src.data.base import Estimate
 log = logging.getLogger(__name__)
 
 
-def main(ctx: mlxp.Context) -> None:
-    log.info("Semi-Supervised Unmixing - [START]...")
+def unmix(ctx, hsi, Y, p, D, H, W, suffix="", tags=None):
+    """
+    Estimate and evaluate the abundances of one (noisy) input HSI
+
+    `suffix` is appended to the estimates artifact name and `tags` are
+    logged along with the metrics (e.g. SNR and seed of a sweep).
+    """
     cfg = ctx.config
     logger = ctx.logger
+    tags = {} if tags is None else tags
+
+    def log_metrics(metrics, log_name):
+        logger.log_metrics({**tags, **metrics}, log_name=log_name)
 
-    # Get noise
-    noise = _instance_from_config(cfg.noise)
-    # Get HSI
-    hsi = _instance_from_config(cfg.data)
-    # Print HSI information
-    log.info(hsi)
-    # Get data
-    Y, p, D = hsi.get_data()
-    # Get image dimensions
-    H, W = hsi.get_img_shape()
-    # Apply noise
-    Y = noise.apply(Y)
-    # L2 normalization
-    if cfg.l2_normalization:
-        Y = Y / np.linalg.norm(Y, axis=0, ord=2, keepdims=True)
-    # Apply SVD projection
-    if cfg.projection:
-        Y = SVD_projection(Y, p)
     # Build model
     model = _instance_from_config(cfg.model)
+    # Least squares solvers run on the signal subspace coordinates
+    if cfg.subspace and model.least_squares:
+        Y_s, D_s, _ = subspace_reduce(Y, D, cfg.subspace_rank)
+    else:
+        Y_s, D_s = Y, D
     # Solve unmixing
-    A_hat = model.compute_abundances(Y, D, p=p, H=H, W=W)
+    deduplicate = cfg.deduplicate and (model.pixelwise or model.weighted)
+    if cfg.tile_size is not None:
+        # NOTE Pixels are deduplicated within each tile
+        A_hat = tiled_abundances(
+            model,
+            Y_s,
+            D_s,
+            H,
+            W,
+            cfg.tile_size,
+            cfg.tile_halo,
+            deduplicate=deduplicate,
+            eps=cfg.dedup_eps,
+            p=p,
+        )
+    elif deduplicate:
+        A_hat = deduplicated_abundances(model, Y_s, D_s, cfg.dedup_eps, p=p)
+    else:
+        A_hat = model.compute_abundances(Y_s, D_s, p=p, H=H, W=W)
 
-    E_hat = np.zeros((Y.shape[0], p))
+    # Sparse abundances
+    if cfg.sparse_threshold is not None or cfg.sparse_top_k is not None:
+        A_hat = sparsify(A_hat, cfg.sparse_threshold, cfg.sparse_top_k)
 
-    logger.log_artifact(Estimate(E_hat, A_hat, H, W), "estimates")
+    E_hat = np.zeros((Y.shape[0], p), dtype=Y.dtype)
+
+    logger.log_artifact(
+        Estimate(E_hat, A_hat, H, W, fmt=cfg.estimates_format),
+        f"estimates{suffix}",
+    )
 
     if hsi.has_GT():
         # Get ground truth
@@ -55,14 +83,14 @@ def main(ctx: mlxp.Context) -> None:
         # TODO align abundances for MUSIC_CSR
         if cfg.force_align:
             aligner = AbundancesAligner(Aref=A_gt)
-            A1 = aligner.fit_transform(A_hat)
+            A1 = aligner.fit_transform(A_hat.toarray() if sp.issparse(A_hat) else A_hat)
         else:
             index = hsi.get_index()
             A1 = A_hat[index]
         # Get labels
         labels = hsi.get_labels()
         # Compute and log metrics
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 SRE(),
                 A_gt,
@@ -73,7 +101,7 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="SRE",
         )
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 aRMSE(),
                 A_gt,
@@ -84,4 +112,42 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="aRMSE",
         )
+
+
+def main(ctx: mlxp.Context) -> None:
+    log.info("Semi-Supervised Unmixing - [START]...")
+    cfg = ctx.config
+
+    # Get noise
+    noise = _instance_from_config(cfg.noise)
+    # Get HSI
+    hsi = _instance_from_config(cfg.data)
+    # Print HSI information
+    log.info(hsi)
+    # Get data
+    Y, p, D = hsi.get_data()
+    # Get image dimensions
+    H, W = hsi.get_img_shape()
+    # Apply noise, L2 normalization and SVD projection
+    # NOTE A sweep over (SNR, seed) pairs runs on a single load of the data
+    inputs = preprocess_sweep(
+        hsi,
+        noise,
+        p,
+        SNRs=cfg.sweep_SNRs,
+        seeds=cfg.sweep_seeds,
+        l2_normalization=cfg.l2_normalization,
+        projection=cfg.projection,
+        projection_method=cfg.projection_method,
+        cache=cfg.inputs_cache,
+        seed=cfg.seed,
+    )
+    for SNR, seed, Y, _ in inputs:
+        if cfg.sweep_SNRs is None:
+            unmix(ctx, hsi, Y, p, D, H, W)
+        else:
+            log.info(f"Sweep => SNR: {SNR}, seed: {seed}")
+            tags = {"SNR": SNR, "seed": seed}
+            unmix(ctx, hsi, Y, p, D, H, W, suffix=f"-SNR{SNR}-seed{seed}", tags=tags)
+
     log.info("Semi-Supervised Unmixing - [END]")
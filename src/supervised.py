@@ -6,7 +6,12 @@ from mlxp.launcher import _instance_from_config
 import logging
 import numpy as np
 
-from src.data.utils import SVD_projection
+from src.data.utils import (
+    preprocess_sweep,
+    tiled_abundances,
+    deduplicated_abundances,
+    subspace_reduce,
+)
 from src.utils.aligners import AbundancesAligner
 from src.utils.metrics import SRE, SADDegrees, aRMSE, eRMSE, compute_metric
 from src.data.base import Estimate
@@ -14,44 +19,59 @@ from src.data.base import Estimate
 log = logging.getLogger(__name__)
 
 
-def main(ctx: mlxp.Context) -> None:
-    log.info("Supervised Unmixing - [START]...")
+def unmix(ctx, hsi, Y, p, H, W, subspace=None, suffix="", tags=None):
+    """
+    Estimate and evaluate the abundances of one (noisy) input HSI
 
+    `subspace` is the `SubspaceEstimator` of Y shared with the extractor.
+    `suffix` is appended to the estimates artifact name and `tags` are
+    logged along with the metrics (e.g. SNR and seed of a sweep).
+    """
     cfg = ctx.config
     logger = ctx.logger
+    tags = {} if tags is None else tags
+
+    def log_metrics(metrics, log_name):
+        logger.log_metrics({**tags, **metrics}, log_name=log_name)
 
-    # Get noise
-    noise = _instance_from_config(cfg.noise)
-    # Get HSI
-    hsi = _instance_from_config(cfg.data)
-    # Print HSI information
-    log.info(hsi)
-    # Get data
-    Y, p, _ = hsi.get_data()
-    # Get image dimensions
-    H, W = hsi.get_img_shape()
-    # Normalize HSI
-    # Y = (Y - Y.min()) / (Y.max() - Y.min())
-    # Apply noise
-    Y = noise.apply(Y)
-    # L2 normalization
-    if cfg.l2_normalization:
-        Y = Y / np.linalg.norm(Y, axis=0, ord=2, keepdims=True)
-    # Apply SVD projection
-    if cfg.projection:
-        Y = SVD_projection(Y, p)
     # Build model
     extractor = _instance_from_config(cfg.extractor)
     model = _instance_from_config(cfg.model)
 
     # Endmember extraction
-    E_hat = extractor.extract_endmembers(Y, p, H=H, W=W)
+    E_hat = extractor.extract_endmembers(Y, p, H=H, W=W, subspace=subspace)
 
+    # Least squares solvers run on the signal subspace coordinates
+    if cfg.subspace and model.least_squares:
+        Y_s, E_hat_s, _ = subspace_reduce(Y, E_hat, cfg.subspace_rank)
+    else:
+        Y_s, E_hat_s = Y, E_hat
     # Abundance estimation
-    A_hat = model.compute_abundances(Y, E_hat, p=p, H=H, W=W)
+    deduplicate = cfg.deduplicate and (model.pixelwise or model.weighted)
+    if cfg.tile_size is not None:
+        # NOTE Pixels are deduplicated within each tile
+        A_hat = tiled_abundances(
+            model,
+            Y_s,
+            E_hat_s,
+            H,
+            W,
+            cfg.tile_size,
+            cfg.tile_halo,
+            deduplicate=deduplicate,
+            eps=cfg.dedup_eps,
+            p=p,
+        )
+    elif deduplicate:
+        A_hat = deduplicated_abundances(model, Y_s, E_hat_s, cfg.dedup_eps, p=p)
+    else:
+        A_hat = model.compute_abundances(Y_s, E_hat_s, p=p, H=H, W=W)
 
     # Save estimates
-    logger.log_artifact(Estimate(E_hat, A_hat, H, W), "estimates")
+    logger.log_artifact(
+        Estimate(E_hat, A_hat, H, W, fmt=cfg.estimates_format),
+        f"estimates{suffix}",
+    )
 
     if hsi.has_GT():
         # Get ground truth
@@ -62,7 +82,7 @@ def main(ctx: mlxp.Context) -> None:
         E1 = aligner.transform_endmembers(E_hat)
         # Get labels
         labels = hsi.get_labels()
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 SRE(),
                 A_gt,
@@ -73,7 +93,7 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="SRE",
         )
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 aRMSE(),
                 A_gt,
@@ -84,7 +104,7 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="aRMSE",
         )
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 SADDegrees(),
                 E_gt,
@@ -95,7 +115,7 @@ def main(ctx: mlxp.Context) -> None:
             ),
             log_name="SAD",
         )
-        logger.log_metrics(
+        log_metrics(
             compute_metric(
                 eRMSE(),
                 E_gt,
@@ -107,4 +127,55 @@ def main(ctx: mlxp.Context) -> None:
             log_name="eRMSE",
         )
 
+
+def main(ctx: mlxp.Context) -> None:
+    log.info("Supervised Unmixing - [START]...")
+
+    cfg = ctx.config
+
+    # Get noise
+    noise = _instance_from_config(cfg.noise)
+    # Get HSI
+    hsi = _instance_from_config(cfg.data)
+    # Print HSI information
+    log.info(hsi)
+    # Get data
+    Y, p, _ = hsi.get_data()
+    # Get image dimensions
+    H, W = hsi.get_img_shape()
+    # Normalize HSI
+    # Y = (Y - Y.min()) / (Y.max() - Y.min())
+    # Apply noise, L2 normalization and SVD projection
+    # NOTE A sweep over (SNR, seed) pairs runs on a single load of the data
+    inputs = preprocess_sweep(
+        hsi,
+        noise,
+        p,
+        SNRs=cfg.sweep_SNRs,
+        seeds=cfg.sweep_seeds,
+        l2_normalization=cfg.l2_normalization,
+        projection=cfg.projection,
+        projection_method=cfg.projection_method,
+        cache=cfg.inputs_cache,
+        seed=cfg.seed,
+        fit_subspace=True,
+    )
+    for SNR, seed, Y, subspace in inputs:
+        if cfg.sweep_SNRs is None:
+            unmix(ctx, hsi, Y, p, H, W, subspace)
+        else:
+            log.info(f"Sweep => SNR: {SNR}, seed: {seed}")
+            tags = {"SNR": SNR, "seed": seed}
+            unmix(
+                ctx,
+                hsi,
+                Y,
+                p,
+                H,
+                W,
+                subspace,
+                suffix=f"-SNR{SNR}-seed{seed}",
+                tags=tags,
+            )
+
     log.info("Supervised Unmixing - [END]...")
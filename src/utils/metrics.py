@@ -6,6 +6,7 @@ import logging
 import numpy as np
 import numpy.linalg as LA
 import pandas as pd
+import scipy.sparse as sp
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -17,6 +18,9 @@ class BaseMetric:
 
     @staticmethod
     def _check_input(X, Xref):
+        # NOTE Sparse abundances are densified once the atoms are selected
+        X = X.toarray() if sp.issparse(X) else X
+        Xref = Xref.toarray() if sp.issparse(Xref) else Xref
         assert X.shape == Xref.shape
         assert type(X) == type(Xref)
         return X, Xref
@@ -111,6 +115,7 @@ def compute_metric(metric, X_gt, X_hat, labels, detail=True, on_endmembers=False
     """
     Return individual and global metric
     """
+    X_hat = X_hat.toarray() if sp.issparse(X_hat) else X_hat
     d = {}
     d["Overall"] = round(metric(X_hat, X_gt), 4)
     if detail:
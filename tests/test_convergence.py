@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from src.model.base import ConvergenceMonitor
+
+
+def run(monitor, losses, estimates, max_iters=1000):
+    for ii in range(max_iters):
+        if monitor.update(ii, losses(ii), estimates(ii)):
+            return ii + 1
+    return None
+
+
+def constant(ii):
+    return np.ones((3, 4))
+
+
+@pytest.mark.parametrize("min_iters, expected", [(0, 40), (35, 40), (100, 100)])
+def test_stops_after_patience_and_min_iters(min_iters, expected):
+    monitor = ConvergenceMonitor(window=10, patience=3, min_iters=min_iters)
+    assert run(monitor, lambda ii: 1.0, constant) == expected
+    assert monitor.stopped_at == expected
+
+
+def test_moving_estimate():
+    monitor = ConvergenceMonitor(window=10, patience=3, min_iters=0)
+    assert run(monitor, lambda ii: 1.0, lambda ii: np.full((3, 4), 1.0 + ii)) is None
+    assert monitor.stopped_at is None
+
+
+def test_improving_loss():
+    monitor = ConvergenceMonitor(window=10, patience=3, min_iters=0)
+    assert run(monitor, lambda ii: 0.99**ii, constant) is None
+
+
+def test_oscillating_loss_plateau():
+    # NOTE The best loss of each window is compared
+    monitor = ConvergenceMonitor(window=10, patience=3, min_iters=0)
+    assert run(monitor, lambda ii: 1.0 + (ii % 7), constant) == 40
+
+
+def test_patience_reset():
+    # Estimate jump at iteration 25: stable checks start again at 40
+    monitor = ConvergenceMonitor(window=10, patience=3, min_iters=0)
+    estimates = lambda ii: np.full((3, 4), 1.0 if ii < 25 else 2.0)
+    assert run(monitor, lambda ii: 1.0, estimates) == 60
+
+    monitor.reset()
+    assert monitor.stopped_at is None
+    assert run(monitor, lambda ii: 1.0, constant) == 40
+
+
+def test_torch_estimates():
+    torch = pytest.importorskip("torch")
+    monitor = ConvergenceMonitor(window=10, patience=3, min_iters=0)
+    assert run(monitor, lambda ii: 1.0, lambda ii: torch.ones(3, 4)) == 40
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("spams")
+
+from src.model.supervised.FCLS import FCLS, DecompSimplex
+
+
+@pytest.fixture
+def scene():
+    rng = np.random.default_rng(0)
+    L, p, N = 30, 5, 500
+    E = rng.random((L, p))
+    A = rng.dirichlet(0.3 * np.ones(p), N).T
+    Y = E @ A + 0.01 * rng.standard_normal((L, N))
+    return Y, E
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_memmap_output(scene, tmp_path, n_jobs):
+    Y, E = scene
+    expected = DecompSimplex(numThreads=1, chunk_size=128).compute_abundances(Y, E)
+    path = str(tmp_path / "A.npy")
+    model = DecompSimplex(numThreads=1, memmap=path, n_jobs=n_jobs, chunk_size=128)
+    A = model.compute_abundances(Y, E)
+    assert isinstance(A, np.memmap)
+    assert np.array_equal(A, expected)
+    assert np.array_equal(np.load(path), expected)
+    # Same problem as FCLS
+    assert np.allclose(expected, FCLS().compute_abundances(Y, E), atol=1e-4)
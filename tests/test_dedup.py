@@ -0,0 +1,28 @@
+import numpy as np
+
+from src.data.utils import deduplicated_abundances, tiled_abundances
+from src.model.supervised.FCLS import FCLS
+
+
+def test_tiles_deduplicated():
+    rng = np.random.default_rng(0)
+    L, p, H, W = 20, 3, 12, 12
+    E = rng.random((L, p))
+    spectra = E @ rng.dirichlet(np.ones(p), 5).T
+    Y = spectra[:, rng.integers(0, 5, H * W)]
+
+    model = FCLS()
+    sizes = []
+    compute_abundances = model.compute_abundances
+
+    def spy(Y, E, *args, **kwargs):
+        sizes.append(Y.shape[1])
+        return compute_abundances(Y, E, *args, **kwargs)
+
+    model.compute_abundances = spy
+    A = tiled_abundances(model, Y, E, H, W, 6, deduplicate=True, p=p)
+
+    # One solve of at most 5 unique pixels per tile
+    assert len(sizes) == 4 and max(sizes) <= 5
+    assert np.allclose(A, deduplicated_abundances(FCLS(), Y, E, p=p))
+    assert np.allclose(A, FCLS().compute_abundances(Y, E), atol=1e-8)
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+envi = pytest.importorskip("spectral.io.envi")
+
+from src.data.envi import EnviFile
+
+
+@pytest.mark.parametrize("interleave", ["bil", "bip", "bsq"])
+@pytest.mark.parametrize("scale", [1.0, 100.0])
+def test_pixels_in_row_major_order(tmp_path, interleave, scale):
+    H, W, L = 4, 5, 3
+    cube = np.random.default_rng(0).integers(0, 1000, (H, W, L)).astype(np.int16)
+    path = str(tmp_path / f"{interleave}.hdr")
+    metadata = {} if scale == 1.0 else {"reflectance scale factor": scale}
+    envi.save_image(path, cube, interleave=interleave, metadata=metadata)
+
+    Y = EnviFile(path).load("Y")
+    expected = cube.reshape(H * W, L).T
+    if scale != 1.0:
+        expected = expected / scale
+    assert Y.dtype == expected.dtype
+    assert np.array_equal(Y, expected)
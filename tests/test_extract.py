@@ -0,0 +1,41 @@
+import numpy as np
+
+from src.data.utils import iter_tiles
+from src.extract import CandidatesClusterer, iter_candidates
+
+
+def test_reproducible_library():
+    rng = np.random.default_rng(0)
+    L, p, H, W = 20, 3, 16, 16
+    E = rng.random((L, p))
+    Y = E @ rng.dirichlet(0.5 * np.ones(p), H * W).T
+    extractors = [
+        {"name": "src.model.extractors.VCA"},
+        {"name": "src.model.extractors.SiVM"},
+    ]
+    jobs = [
+        (extractor, Y_tile, p, 0, 0)
+        for Y_tile, _, _, _ in iter_tiles(Y, H, W, 8, 8)
+        for extractor in extractors
+    ]
+
+    libraries = []
+    for workers in (1, 2):
+        clusterer = CandidatesClusterer(p, 4, seed=0)
+        candidates = []
+        for E_tile in iter_candidates(iter(jobs), workers):
+            candidates.append(E_tile)
+            clusterer.partial_fit(E_tile)
+        candidates = np.hstack(candidates)
+        libraries.append(
+            (candidates, clusterer.predict(candidates), clusterer.nearest(candidates))
+        )
+
+    (D, clusters, index), (D2, clusters2, index2) = libraries
+    assert D.shape == (L, p * len(jobs))
+    assert np.array_equal(D, D2)
+    assert np.array_equal(clusters, clusters2)
+    assert np.array_equal(index, index2)
+    # One atom per cluster
+    assert index.shape == (p,)
+    assert np.array_equal(np.sort(clusters[index]), np.arange(p))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from src.model.supervised.FCLS import FCLS
+
+
+@pytest.fixture
+def scene():
+    rng = np.random.default_rng(0)
+    L, p, N = 30, 6, 400
+    E = rng.random((L, p))
+    # Pixels outside of the simplex (active nonnegativity constraints)
+    A = rng.dirichlet(0.3 * np.ones(p), N).T
+    Y = E @ A + 0.05 * rng.standard_normal((L, N))
+    return Y, E
+
+
+def objective(Y, E, A):
+    return np.sum((Y - E @ A) ** 2, axis=0)
+
+
+def test_active_set_matches_cvxopt(scene):
+    Y, E = scene
+    A = FCLS(engine="active_set", closed_form=False).compute_abundances(Y, E)
+    A_ref = FCLS(engine="cvxopt", closed_form=False).compute_abundances(Y, E)
+    assert np.all(A >= 0)
+    assert np.allclose(A.sum(axis=0), 1)
+    # NOTE cvxopt stops on an interior point tolerance
+    assert np.all(objective(Y, E, A) <= objective(Y, E, A_ref) + 1e-10)
+    assert np.allclose(objective(Y, E, A), objective(Y, E, A_ref), rtol=1e-3)
+
+
+def test_closed_form_warm_start(scene):
+    Y, E = scene
+    model = FCLS(closed_form=True)
+    A = model.compute_abundances(Y, E)
+    # Only the pixels with a negative SCLS solution go to the engine
+    assert 0 < model.n_constrained < Y.shape[1]
+    assert model.n_closed_form + model.n_constrained == Y.shape[1]
+    assert np.allclose(A, FCLS(closed_form=False).compute_abundances(Y, E), atol=1e-8)
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+@pytest.mark.parametrize("n_jobs", [1, 2, 3])
+def test_identical_for_any_workers(scene, tmp_path, backend, n_jobs):
+    Y, E = scene
+    expected = FCLS(chunk_size=64).compute_abundances(Y, E)
+    model = FCLS(n_jobs=n_jobs, chunk_size=64, backend=backend)
+    assert np.array_equal(model.compute_abundances(Y, E), expected)
+    # Memory-mapped pixels
+    Y_mm = np.lib.format.open_memmap(str(tmp_path / "Y.npy"), "w+", Y.dtype, Y.shape)
+    Y_mm[...] = Y
+    assert np.array_equal(model.compute_abundances(Y_mm, E), expected)
@@ -0,0 +1,55 @@
+import types
+
+import numpy as np
+
+from src.data.noise import AdditiveWhiteGaussianNoise
+from src.data.utils import preprocess, preprocess_sweep
+
+
+def make_hsi(tmp_path):
+    source = tmp_path / "scene.mat"
+    source.write_bytes(b"scene")
+    Y = np.random.default_rng(0).random((8, 300)).astype(np.float32)
+    return types.SimpleNamespace(
+        Y=Y,
+        data_dir=str(tmp_path),
+        sources=[str(source)],
+        level=None,
+        dtype=Y.dtype,
+    )
+
+
+def sweep(hsi, SNRs, seeds, cache):
+    noise = AdditiveWhiteGaussianNoise()
+    inputs = preprocess_sweep(hsi, noise, 3, SNRs=SNRs, seeds=seeds, cache=cache)
+    return {(SNR, seed): np.array(Y) for SNR, seed, Y, _ in inputs}
+
+
+def test_sweep_is_reproducible(tmp_path):
+    hsi = make_hsi(tmp_path)
+    first = sweep(hsi, [20, 30], [0, 1], cache=False)
+    second = sweep(hsi, [20, 30], [0, 1], cache=False)
+    assert first.keys() == second.keys()
+    for key in first:
+        assert np.array_equal(first[key], second[key])
+    assert not np.array_equal(first[(20, 0)], first[(20, 1)])
+
+
+def test_single_run_and_sweep_share_cached_inputs(tmp_path):
+    hsi = make_hsi(tmp_path)
+    for SNR, seed in [(20, 0), (30, 1)]:
+        # Global seed and noise seed
+        for noise, global_seed in [
+            (AdditiveWhiteGaussianNoise(SNR=SNR), seed),
+            (AdditiveWhiteGaussianNoise(SNR=SNR, seed=seed), None),
+        ]:
+            single, _ = preprocess(hsi, noise, 3, seed=global_seed)
+            cached, _ = preprocess(hsi, noise, 3, cache=True, seed=global_seed)
+            assert np.array_equal(single, cached)
+
+    uncached = sweep(hsi, [20, 30], [0, 1], cache=False)
+    cached = sweep(hsi, [20, 30], [0, 1], cache=True)
+    single, _ = preprocess(hsi, AdditiveWhiteGaussianNoise(SNR=20), 3, seed=0)
+    assert np.array_equal(uncached[(20, 0)], single)
+    for key in uncached:
+        assert np.array_equal(uncached[key], cached[key])
@@ -0,0 +1,77 @@
+import types
+import warnings
+
+import numpy as np
+import pytest
+
+from src.data.noise import AdditiveWhiteGaussianNoise
+from src.data.utils import SVD_projection, SubspaceEstimator, preprocess, projection_method
+from src.model.extractors import VCA
+
+
+@pytest.fixture
+def hsi(tmp_path):
+    rng = np.random.default_rng(0)
+    L, p, N = 30, 3, 2000
+    E = rng.random((L, p))
+    A = rng.dirichlet(np.ones(p), N).T
+    return types.SimpleNamespace(
+        Y=E @ A,
+        data_dir=str(tmp_path),
+        sources=[],
+        level=None,
+        dtype=np.dtype("float64"),
+    )
+
+
+@pytest.mark.parametrize("method", ["gram", "randomized", "exact"])
+def test_projection_method(hsi, method):
+    noise = AdditiveWhiteGaussianNoise(SNR=20, seed=0)
+    Y, subspace = preprocess(
+        hsi, noise, 3, projection=True, fit_subspace=True, projection_method=method
+    )
+    expected = SVD_projection(noise.apply(hsi.Y, seed=0), 3, method)
+    assert np.array_equal(Y, expected)
+    # Moments of the clipped projected pixels
+    refit = SubspaceEstimator().fit(Y)
+    assert np.allclose(subspace.moment, refit.moment)
+    assert np.allclose(subspace.mean, refit.mean)
+
+
+def test_vca_on_projected_inputs(hsi):
+    noise = AdditiveWhiteGaussianNoise(SNR=30, seed=0)
+    Y, subspace = preprocess(hsi, noise, 3, projection=True, fit_subspace=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        E = VCA().extract_endmembers(Y, 3, seed=0, subspace=subspace)
+    assert E.shape == (30, 3)
+    assert np.all(np.isfinite(E))
+
+
+def test_projection_methods_agree(hsi):
+    Y = AdditiveWhiteGaussianNoise(SNR=40, seed=0).apply(hsi.Y, seed=0)
+    exact = SVD_projection(Y, 3, "exact")
+    for method in ("gram", "randomized"):
+        assert np.allclose(SVD_projection(Y, 3, method, chunk_size=300), exact, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "shape, p, expected",
+    [((100, 150), 5, "exact"), ((100, 10000), 5, "gram"), ((2000, 10000), 5, "randomized")],
+)
+def test_auto_projection_method(shape, p, expected):
+    assert projection_method(np.empty(shape), p) == expected
+
+
+def test_streaming_subspace_estimator(hsi):
+    Y = AdditiveWhiteGaussianNoise(SNR=30, seed=0).apply(hsi.Y, seed=0)
+    full = SubspaceEstimator().fit(Y, chunk_size=Y.shape[1])
+    # Uneven chunks, as read from tiles or a memmap
+    streamed = SubspaceEstimator().fit(Y[:, i : i + 333] for i in range(0, Y.shape[1], 333))
+    assert streamed.n == full.n
+    assert np.allclose(streamed.mean, full.mean)
+    assert np.allclose(streamed.covariance(), full.covariance())
+    assert np.allclose(streamed.covariance(), np.cov(Y, bias=True))
+    assert np.allclose(
+        SVD_projection(Y, 3, subspace=streamed), SVD_projection(Y, 3, "gram"), atol=1e-6
+    )
@@ -0,0 +1,46 @@
+import numpy as np
+import scipy.io as sio
+
+from src.data.pyramid import PyramidFile, build_pyramid
+
+
+def test_cell_array_labels(tmp_path):
+    H, W, L, p = 4, 4, 5, 2
+    rng = np.random.default_rng(0)
+    E = rng.random((L, p))
+    A = rng.dirichlet(np.ones(p), H * W).T
+    labels = np.empty((1, p), dtype=object)
+    labels[0, 0], labels[0, 1] = "Soil  ", "Tree"
+    src = tmp_path / "scene.mat"
+    sio.savemat(src, {"Y": E @ A, "E": E, "A": A, "H": H, "W": W, "labels": labels})
+
+    dst = build_pyramid(str(src), str(tmp_path / "scene.h5"), [2])
+
+    reader = PyramidFile(dst, 2)
+    assert list(reader.load("labels")) == ["Soil", "Tree"]
+    assert reader.load("Y").shape == (L, 4)
+    reader.close()
+
+
+def test_non_nested_resolutions_by_strips(tmp_path):
+    H, W, L, p = 24, 24, 2, 2
+    rng = np.random.default_rng(0)
+    E = rng.random((L, p))
+    A = rng.dirichlet(np.ones(p), H * W).T
+    Y = E @ A
+    src = tmp_path / "scene.mat"
+    sio.savemat(src, {"Y": Y, "E": E, "A": A, "H": H, "W": W})
+
+    # NOTE Factors 3 and 4, strips of 8 lines before rounding
+    dst = build_pyramid(
+        str(src), str(tmp_path / "scene.h5"), [8, 6], strip_size=W * L * 8
+    )
+
+    for res in (8, 6):
+        f = H // res
+        reader = PyramidFile(dst, res)
+        Y_res = reader.load("Y")
+        expected = Y.reshape(L, res, f, res, f).mean(axis=(2, 4)).reshape(L, -1)
+        assert np.allclose(Y_res, expected)
+        assert np.allclose(reader.load("A").sum(axis=0), 1)
+        reader.close()
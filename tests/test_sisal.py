@@ -0,0 +1,86 @@
+import logging
+
+import numpy as np
+import pytest
+
+from src.model.extractors import SISAL
+
+
+def SAD(E1, E2):
+    """
+    Mean spectral angle (in degrees) of each column of E2 to its closest match in E1
+    """
+    E1 = E1 / np.linalg.norm(E1, axis=0)
+    E2 = E2 / np.linalg.norm(E2, axis=0)
+    cos = np.clip((E1.T @ E2).max(axis=0), -1, 1)
+    return np.degrees(np.arccos(cos)).mean()
+
+
+@pytest.fixture
+def scene():
+    rng = np.random.default_rng(0)
+    L, p, N = 50, 4, 20000
+    E = rng.random((L, p))
+    A = rng.dirichlet(0.3 * np.ones(p), N).T
+    Y = E @ A + 0.002 * rng.standard_normal((L, N))
+    return Y.astype(np.float32), E, p
+
+
+@pytest.mark.parametrize("coreset", [500, 2000])
+def test_coreset_matches_full(scene, coreset):
+    Y, E, p = scene
+    full = SISAL().extract_endmembers(Y, p, seed=1)
+    Ehat = SISAL(coreset=coreset).extract_endmembers(Y, p, seed=1)
+    assert SAD(full, Ehat) < 2.0
+    assert SAD(E, Ehat) < SAD(E, full) + 1.0
+
+
+def test_soft_neg_in_place():
+    y = np.random.default_rng(0).standard_normal((3, 100))
+    expected = SISAL.soft_neg(y, 0.3)
+    out = np.empty_like(y)
+    assert np.allclose(SISAL.soft_neg(y.copy(), 0.3, out=out), expected)
+
+
+@pytest.fixture
+def small_scene():
+    rng = np.random.default_rng(0)
+    L, p, N = 10, 3, 500
+    E = rng.random((L, p))
+    A = rng.dirichlet(0.5 * np.ones(p), N).T
+    return E @ A + 0.01 * rng.standard_normal((L, N)), p
+
+
+def test_matches_previous_code(small_scene):
+    Y, p = small_scene
+    # Estimates of the SISAL implementation prior to the in-place AL iterations
+    expected = np.array(
+        [
+            [0.21995245395926746, 0.4271673076370816, 0.30238883696433294],
+            [0.6982037438295449, 0.38642284164601387, 0.6580785253285292],
+            [0.5979194182780816, 0.620671778747765, 0.6619224192847136],
+            [0.3810613093289458, 0.7075599992247813, 0.6667126902616394],
+            [0.6057008507844107, 0.6472872939582093, 0.3667296891348643],
+            [0.5336722585837564, 0.40749255827602576, 0.6407273281684884],
+            [0.1736362117016924, 0.2677711711365129, 0.3101482570015183],
+            [0.5396759094000821, 0.3574043780199348, 0.5438540364848908],
+            [0.7812952256135931, 0.6461581463188784, 0.5682990203293155],
+            [0.7296462915382134, 0.8441080319121641, 0.7441069910584637],
+        ]
+    )
+    assert np.allclose(SISAL().extract_endmembers(Y, p, seed=0), expected, atol=1e-8)
+
+
+def test_early_termination(small_scene, caplog):
+    Y, p = small_scene
+    full = SISAL().extract_endmembers(Y, p, seed=0)
+    with caplog.at_level(logging.DEBUG, logger="src.model.extractors"):
+        E_hat = SISAL(tol_f=0.1).extract_endmembers(Y, p, seed=0)
+    assert "SISAL converged" in caplog.text
+    assert SAD(full, E_hat) < 2.0
+
+
+def test_active_margin(small_scene):
+    Y, p = small_scene
+    full = SISAL().extract_endmembers(Y, p, seed=0)
+    assert SAD(full, SISAL(active_margin=0.1).extract_endmembers(Y, p, seed=0)) < 1.0
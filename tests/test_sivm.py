@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from src.model.extractors import SiVM
+
+
+def reference_indices(x, p):
+    """
+    Per-pixel loops of the original SiVM implementation
+    """
+    D, N = x.shape
+    d = np.zeros((p, N))
+    V = np.zeros(N)
+    for i in range(N):
+        d[0, i] = x[:, i] @ x[:, i]
+    index = [np.argmax(d[0])]
+    for i in range(N):
+        a = x[:, i] - x[:, index[0]]
+        d[0, i] = a @ a
+    for v in range(1, p):
+        D4 = np.ones((v + 1, v + 1))
+        D4[:v, :v] = d[:v, index]
+        D4[v, v] = 0
+        D4 = np.linalg.inv(D4)
+        for i in range(N):
+            D3 = np.append(d[:v, i], 1)
+            V[i] = D3 @ D4 @ D3
+        index.append(np.argmax(V))
+        for i in range(N):
+            a = x[:, i] - x[:, index[v]]
+            d[v, i] = a @ a
+    return np.sort(index)
+
+
+@pytest.mark.parametrize("chunk_size", [2**16, 37])
+def test_same_indices(chunk_size):
+    rng = np.random.default_rng(0)
+    L, p, N = 30, 5, 1000
+    E = rng.random((L, p))
+    A = rng.dirichlet(0.5 * np.ones(p), N).T
+    Y = E @ A + 0.01 * rng.standard_normal((L, N))
+
+    index = reference_indices(Y, p)
+    assert np.array_equal(SiVM(chunk_size).extract_endmembers(Y, p), Y[:, index])
@@ -0,0 +1,31 @@
+import numpy as np
+
+from src.data.utils import subspace_reduce
+from src.model.supervised.FCLS import FCLS
+
+
+def test_same_least_squares_solutions():
+    rng = np.random.default_rng(0)
+    L, p, N = 50, 4, 500
+    E = rng.random((L, p))
+    A = rng.dirichlet(np.ones(p), N).T
+    Y = E @ A + 0.01 * rng.standard_normal((L, N))
+
+    Y_k, E_k, Q = subspace_reduce(Y, E)
+    assert Y_k.shape == (p, N) and E_k.shape == (p, p)
+    assert np.allclose(Q @ E_k, E)
+    # Unconstrained and fully constrained least squares
+    assert np.allclose(np.linalg.lstsq(E_k, Y_k)[0], np.linalg.lstsq(E, Y)[0])
+    assert np.allclose(
+        FCLS().compute_abundances(Y_k, E_k), FCLS().compute_abundances(Y, E), atol=1e-8
+    )
+
+
+def test_rank_deficient_endmembers():
+    rng = np.random.default_rng(0)
+    D = rng.random((50, 3))
+    D = np.hstack([D, D @ [[0.5], [0.5], [0.0]]])
+    Y_k, E_k, Q = subspace_reduce(rng.random((50, 10)), D)
+    assert Q.shape == (50, 3)
+    Y_k, E_k, Q = subspace_reduce(rng.random((50, 10)), D, rank=2)
+    assert E_k.shape == (2, 4)
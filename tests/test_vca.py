@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from src.model.extractors import VCA
+
+
+def reference_indices(Y, p, seed):
+    """
+    Original VCA translation (one SVD per subspace, one pinv per direction)
+    """
+    L, N = Y.shape
+    generator = np.random.default_rng(seed=seed)
+    y_m = np.mean(Y, axis=1, keepdims=True)
+    Y_o = Y - y_m
+    Ud = np.linalg.svd(Y_o @ Y_o.T / N)[0][:, :p]
+    x_p = Ud.T @ Y_o
+    P_y = np.sum(Y**2) / N
+    P_x = np.sum(x_p**2) / N + np.sum(y_m**2)
+    SNR = 10 * np.log10((P_x - p / L * P_y) / (P_y - P_x))
+
+    if SNR < 15 + 10 * np.log10(p):
+        x = x_p[: p - 1]
+        c = np.amax(np.sum(x**2, axis=0)) ** 0.5
+        y = np.vstack((x, c * np.ones((1, N))))
+    else:
+        Ud = np.linalg.svd(Y @ Y.T / N)[0][:, :p]
+        x = Ud.T @ Y
+        u = np.mean(x, axis=1, keepdims=True)
+        y = x / (u.T @ x)
+
+    indices = np.zeros(p, dtype=int)
+    A = np.zeros((p, p))
+    A[-1, 0] = 1
+    for i in range(p):
+        w = generator.random(size=(p, 1))
+        f = w - A @ (np.linalg.pinv(A) @ w)
+        f = f / np.linalg.norm(f)
+        indices[i] = np.argmax(np.abs(f.T @ y))
+        A[:, i] = y[:, indices[i]]
+    return indices
+
+
+@pytest.mark.parametrize("sigma", [1e-3, 0.05])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_same_indices(sigma, seed):
+    rng = np.random.default_rng(0)
+    L, p, N = 40, 5, 3000
+    E = rng.random((L, p))
+    A = rng.dirichlet(0.5 * np.ones(p), N).T
+    Y = E @ A + sigma * rng.standard_normal((L, N))
+
+    vca = VCA()
+    vca.extract_endmembers(Y, p, seed=seed)
+    assert np.array_equal(vca.indices, reference_indices(Y, p, seed))
+    # Memoized results
+    E_hat = vca.extract_endmembers(Y, p, seed=seed)
+    assert np.array_equal(vca.indices, reference_indices(Y, p, seed))
+    assert np.array_equal(E_hat, VCA().extract_endmembers(Y.copy(), p, seed=seed))
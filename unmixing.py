@@ -39,6 +39,8 @@ def unmixing(ctx: mlxp.Context) -> None:
         from src.semisupervised import main as _main
     elif mode == "pruning":
         from src.pruning import main as _main
+    elif mode == "extract":
+        from src.extract import main as _main
     else:
         raise ValueError(f"Mode {mode} is invalid")
 
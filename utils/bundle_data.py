@@ -6,39 +6,91 @@ $ python -m utils.bundle_data --name Sim1 -Y Y_clean -E E -A XT [-D EE]
 
 It assumes that Sim1 is located in the $PROJECT_ROOT/data folder
 
-"""
+Whole sweeps can be converted in parallel, either from a glob on the scenes
+folders or from a manifest listing one scene name per line:
+$ python -m utils.bundle_data --glob "FWP1_*" -Y Y -E E -A A --workers 8 --compress
+$ python -m utils.bundle_data --manifest scenes.txt -Y Y -E E -A A
 
-import scipy.io as sio
+Scenes whose bundled file is newer than all their inputs are skipped
+unless `--force` is set.
 
+"""
+
+import glob
+import logging
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import scipy.io as sio
+
+from src.data.matfile import MatFile, savemat73
+
+log = logging.getLogger(__name__)
+
 
 def as_matlab(key):
     return f"{key}.mat"
 
 
-def main(args):
+def load(base_dir, key):
+    reader = MatFile(os.path.join(base_dir, as_matlab(key)))
+    value = reader.load(key)
+    reader.close()
+    return value
+
+
+def inputs(name, hsi, endmembers, abundances, dictionary=None, index=None, data_dir="./data"):
+    base_dir = os.path.join(data_dir, name)
+    keys = [hsi, endmembers, abundances, dictionary, index]
+    return [os.path.join(base_dir, as_matlab(key)) for key in keys if key is not None]
+
+
+def is_up_to_date(output, sources):
+    if not os.path.isfile(output):
+        return False
+    mtime = os.stat(output).st_mtime_ns
+    return all(os.stat(source).st_mtime_ns < mtime for source in sources)
+
+
+def bundle(
+    name,
+    hsi,
+    endmembers,
+    abundances,
+    dictionary=None,
+    index=None,
+    height=None,
+    width=None,
+    data_dir="./data",
+    fmt="v5",
+    compress=False,
+    force=False,
+):
+    """
+    Bundle the scene `name` into `<data_dir>/<name>.mat`
+
+    Returns the output path, or None when the output is already up to date.
+    """
+    base_dir = os.path.join(data_dir, name)
+    output = os.path.join(data_dir, as_matlab(name))
+
+    sources = inputs(name, hsi, endmembers, abundances, dictionary, index, data_dir)
+    if not force and is_up_to_date(output, sources):
+        log.info(f"{output} is up to date, skipping {name}")
+        return None
+
+    # NOTE Variables are read one at a time (memory-mapped for v7.3 inputs)
+    Y = load(base_dir, hsi)
+    E = load(base_dir, endmembers)
+    A = load(base_dir, abundances)
+    if dictionary is not None:
+        D = load(base_dir, dictionary)
+        if index is not None:
+            index = list(load(base_dir, index).squeeze())
 
-    base_dir = f"./data/{args.name}/"
-
-    Y = sio.loadmat(os.path.join(base_dir, as_matlab(args.hsi)))[args.hsi]
-    E = sio.loadmat(os.path.join(base_dir, as_matlab(args.endmembers)))[args.endmembers]
-    A = sio.loadmat(os.path.join(base_dir, as_matlab(args.abundances)))[args.abundances]
-    if args.dictionary is not None:
-        D = sio.loadmat(os.path.join(base_dir, as_matlab(args.dictionary)))[
-            args.dictionary
-        ]
-        if args.index is not None:
-            index = list(
-                sio.loadmat(os.path.join(base_dir, as_matlab(args.index)))[
-                    args.index
-                ].squeeze()
-            )
-
-    if args.height is not None:
-        H = args.H
-    if args.width is not None:
-        W = args.W
+    H = int(height) if height is not None else None
+    W = int(width) if width is not None else None
 
     assert len(E.shape) == 2
     if E.shape[0] < E.shape[1]:  # p x L
@@ -46,20 +98,22 @@ def main(args):
 
     L, p = E.shape
 
+    # NOTE Reshapes below copy the inputs that are not C-contiguous
+    # (e.g. Fortran ordered v5 arrays or transposed memory maps)
     if len(Y.shape) == 3:
         if Y.shape[0] == L:
-            if args.height is not None:
+            if H is not None:
                 assert Y.shape[1] == H
-            if args.width is not None:
+            if W is not None:
                 assert Y.shape[2] == W
             H, W = Y.shape[1], Y.shape[2]
             N = H * W
             Y = Y.reshape(L, N)
         elif Y.shape[2] == L:
-            if args.height is not None:
-                assert Y.shape[1] == H
-            if args.width is not None:
-                assert Y.shape[2] == W
+            if H is not None:
+                assert Y.shape[0] == H
+            if W is not None:
+                assert Y.shape[1] == W
             H, W = Y.shape[0], Y.shape[1]
             N = H * W
             Y = Y.reshape(N, L).T
@@ -68,8 +122,11 @@ def main(args):
 
     elif len(Y.shape) == 2:
         if Y.shape[0] != L:  # N x L
-            N = Y.shape[0]
             Y = Y.T  # L x N
+        N = Y.shape[1]
+        if H is None or W is None:
+            raise ValueError("Height and width are required for a 2D HSI...")
+        assert H * W == N
 
     else:
         raise ValueError("Invalid shape for Y...")
@@ -79,8 +136,7 @@ def main(args):
             assert A.shape[1] * A.shape[2] == N
             A = A.reshape(p, A.shape[1] * A.shape[2])
         elif A.shape[2] == p:
-            A = A.transpose((2, 0, 1))
-            A = A.reshape(p, N)
+            A = A.reshape(N, p).T
         else:
             raise ValueError("Corner case not handled...")
 
@@ -101,21 +157,90 @@ def main(args):
         "L": L,
     }
 
-    if args.dictionary is not None:
+    if dictionary is not None:
         data["D"] = D
         data["M"] = D.shape[0] if D.shape[1] == L else D.shape[1]
-        if args.index is not None:
+        if index is not None:
             assert len(index) == p
             data["index"] = index
 
-    sio.savemat(f"./data/{args.name}.mat", data)
+    # Write next to the output and swap once complete
+    tmp_output = f"{output}.tmp-{os.getpid()}"
+    if fmt == "v7.3":
+        savemat73(tmp_output, data, compress=compress)
+    else:
+        sio.savemat(tmp_output, data, appendmat=False, do_compression=compress)
+    os.replace(tmp_output, output)
+
+    log.info(f"{name} bundled into {output}")
+    return output
+
+
+def scenes(args):
+    if args.name is not None:
+        return [args.name]
+
+    if args.glob is not None:
+        pattern = os.path.join(args.data_dir, args.glob)
+        return sorted(
+            os.path.basename(os.path.normpath(path))
+            for path in glob.glob(pattern)
+            if os.path.isdir(path)
+        )
+
+    with open(args.manifest, "r") as f:
+        lines = [line.split("#")[0].strip() for line in f]
+    return [line for line in lines if line]
+
+
+def main(args):
+
+    kwargs = {
+        "hsi": args.hsi,
+        "endmembers": args.endmembers,
+        "abundances": args.abundances,
+        "dictionary": args.dictionary,
+        "index": args.index,
+        "height": args.height,
+        "width": args.width,
+        "data_dir": args.data_dir,
+        "fmt": args.format,
+        "compress": args.compress,
+        "force": args.force,
+    }
+
+    names = scenes(args)
+    log.info(f"{len(names)} scene(s) to bundle")
+
+    if len(names) == 1 or args.workers == 1:
+        for name in names:
+            bundle(name, **kwargs)
+        return
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {name: executor.submit(bundle, name, **kwargs) for name in names}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                log.error(f"Failed to bundle {name}: {e}")
+                failed.append(name)
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} scene(s) failed: {failed}")
 
 
 if __name__ == "__main__":
 
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
     # Parser
     parser = argparse.ArgumentParser(description="Data bundler")
-    parser.add_argument("--name", required=True)
+    scene = parser.add_mutually_exclusive_group(required=True)
+    scene.add_argument("--name")
+    scene.add_argument("--glob", help="Pattern on the scenes folders in data_dir")
+    scene.add_argument("--manifest", help="Text file listing one scene per line")
     parser.add_argument("--hsi", "-Y", required=True)
     parser.add_argument("--endmembers", "-E", required=True)
     parser.add_argument("--abundances", "-A", required=True)
@@ -123,6 +248,11 @@ if __name__ == "__main__":
     parser.add_argument("--index", "-I", required=False, default=None)
     parser.add_argument("--height", "-H", required=False, default=None)
     parser.add_argument("--width", "-W", required=False, default=None)
+    parser.add_argument("--data_dir", required=False, default="./data")
+    parser.add_argument("--format", choices=["v5", "v7.3"], default="v5")
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
 
     args = parser.parse_args()
 